@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Load generator for the Daily Uplift SMS API and dashboard handlers.
+
+Replays API Gateway proxy events against api_handler.lambda_handler and
+web_handler.lambda_handler in-process, backed by in-memory DynamoDB and SNS
+stand-ins, and reports latency percentiles, throughput and memory per route.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+# The handlers read configuration at import time
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('SNS_TOPIC_ARN', 'arn:aws:sns:us-east-1:000000000000:daily-uplift-sms-topic')
+os.environ.setdefault('SUBSCRIBERS_TABLE', 'daily-uplift-subscribers')
+os.environ.setdefault('ANALYTICS_TABLE', 'daily-uplift-analytics')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+import analytics_compaction
+import api_handler
+import opt_out
+import subscriber_cache
+import web_handler
+
+CATEGORIES = ['motivation', 'mental_health', 'mindfulness', 'encouragement']
+
+class LocalTable:
+    """
+    In-memory stand-in for a DynamoDB table resource
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def scan(self, ProjectionExpression=None, ExpressionAttributeNames=None, Limit=None, ExclusiveStartKey=None, **kwargs):
+        with self.lock:
+            items = list(self.items.values())
+        if ExclusiveStartKey:
+            keys = [item[self.key] for item in items]
+            items = items[keys.index(ExclusiveStartKey[self.key]) + 1:]
+        last_key = None
+        if Limit is not None and len(items) > Limit:
+            items = items[:Limit]
+            last_key = {self.key: items[-1][self.key]}
+        if ProjectionExpression:
+            names = ExpressionAttributeNames or {}
+            fields = [names.get(name.strip(), name.strip()) for name in ProjectionExpression.split(',')]
+            items = [{field: item[field] for field in fields if field in item} for item in items]
+        else:
+            items = [dict(item) for item in items]
+        response = {'Items': items, 'Count': len(items)}
+        if last_key:
+            response['LastEvaluatedKey'] = last_key
+        return response
+
+    def get_item(self, Key, **kwargs):
+        with self.lock:
+            item = self.items.get(Key[self.key])
+            return {'Item': dict(item)} if item else {}
+
+    def put_item(self, Item):
+        with self.lock:
+            self.items[Item[self.key]] = dict(Item)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues, **kwargs):
+        # Supports the "set a = :a, b = :b" expressions the handlers use
+        with self.lock:
+            old = self.items.get(Key[self.key])
+            item = self.items.setdefault(Key[self.key], dict(Key))
+            old = dict(old) if old else None
+            for assignment in UpdateExpression.split(None, 1)[1].split(','):
+                name, value = (part.strip() for part in assignment.split('='))
+                item[name] = ExpressionAttributeValues[value]
+        if kwargs.get('ReturnValues') == 'ALL_OLD' and old:
+            return {'Attributes': old}
+        return {}
+
+class LocalDynamoDB:
+    """
+    In-memory stand-in for the DynamoDB resource
+    """
+
+    def __init__(self):
+        self.tables = {
+            os.environ['SUBSCRIBERS_TABLE']: LocalTable('phone_number'),
+            os.environ['ANALYTICS_TABLE']: LocalTable('message_id')
+        }
+
+    def Table(self, name):
+        return self.tables[name]
+
+class LocalSNS:
+    """
+    In-memory stand-in for the SNS client
+    """
+
+    def __init__(self, publish_latency=0.0):
+        self.publish_latency = publish_latency
+
+    def publish(self, **kwargs):
+        if self.publish_latency:
+            time.sleep(self.publish_latency)
+        return {'MessageId': str(uuid.uuid4())}
+
+    def subscribe(self, TopicArn, Protocol, Endpoint):
+        return {'SubscriptionArn': f"{TopicArn}:{uuid.uuid4()}"}
+
+    def unsubscribe(self, SubscriptionArn):
+        return {}
+
+    def list_phone_numbers_opted_out(self, **kwargs):
+        return {'phoneNumbers': []}
+
+def random_phone():
+    return f"+1555{random.randrange(10 ** 7):07d}"
+
+def seed(dynamodb, subscribers, analytics_rows):
+    """
+    Fill the local tables with realistic subscribers and analytics rows
+    """
+    subscribers_table = dynamodb.Table(os.environ['SUBSCRIBERS_TABLE'])
+    for _ in range(subscribers):
+        category = random.choice(CATEGORIES)
+        # Numbers come back from boto3 as Decimal
+        subscribers_table.put_item(Item={
+            'phone_number': random_phone(),
+            'subscription_arn': f"{os.environ['SNS_TOPIC_ARN']}:{uuid.uuid4()}",
+            'active': random.random() > 0.1,
+            'preferred_category': category,
+            f'rotation_{category}': Decimal(random.randrange(100)),
+            'created_at': datetime.utcnow().isoformat()
+        })
+
+    analytics_table = dynamodb.Table(os.environ['ANALYTICS_TABLE'])
+    now = datetime.utcnow()
+    for _ in range(analytics_rows):
+        analytics_table.put_item(Item={
+            'message_id': str(uuid.uuid4()),
+            'timestamp': (now - timedelta(minutes=random.randrange(60 * 24 * 60))).isoformat(),
+            'category': random.choice(CATEGORIES),
+            'subscriber_count': Decimal(1),
+            'segments': Decimal(1)
+        })
+
+def proxy_event(method, path, body=None, query=None):
+    """
+    Build an API Gateway REST proxy event
+    """
+    return {
+        'resource': path,
+        'path': path,
+        'httpMethod': method,
+        'headers': {
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate, br',
+            'Content-Type': 'application/json',
+            'User-Agent': 'daily-uplift-load-test',
+            'x-api-key': 'load-test'
+        },
+        'queryStringParameters': query,
+        'pathParameters': None,
+        'requestContext': {
+            'requestId': str(uuid.uuid4()),
+            'stage': 'prod',
+            'httpMethod': method,
+            'path': f"/prod{path}"
+        },
+        'body': json.dumps(body) if body is not None else None,
+        'isBase64Encoded': False
+    }
+
+# Route name -> (handler module, event factory)
+ROUTES = {
+    'GET /subscribers': (api_handler, lambda: proxy_event('GET', '/subscribers')),
+    'POST /subscribers': (api_handler, lambda: proxy_event('POST', '/subscribers', {
+        'action': random.choice(['add', 'update']),
+        'phone': random_phone(),
+        'category': random.choice(CATEGORIES)
+    })),
+    'GET /analytics': (api_handler, lambda: proxy_event('GET', '/analytics', query={'days': '30'})),
+    'POST /send': (api_handler, lambda: proxy_event('POST', '/send', {
+        'phone': random_phone(),
+        'message': 'You are capable of amazing things. Keep going!',
+        'category': 'custom'
+    })),
+    'GET /': (web_handler, lambda: proxy_event('GET', '/')),
+    'GET /js/dashboard.js': (web_handler, lambda: proxy_event('GET', '/js/dashboard.js'))
+}
+
+# Default mix: mostly dashboard reads
+DEFAULT_WEIGHTS = {
+    'GET /subscribers': 25,
+    'POST /subscribers': 5,
+    'GET /analytics': 25,
+    'POST /send': 5,
+    'GET /': 20,
+    'GET /js/dashboard.js': 20
+}
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+def invoke(route):
+    handler, make_event = ROUTES[route]
+    event = make_event()
+    started = time.perf_counter()
+    response = handler.lambda_handler(event, None)
+    return time.perf_counter() - started, response.get('statusCode', 0), len(response.get('body') or '')
+
+def run_load(routes, weights, requests, concurrency, rate):
+    """
+    Replay `requests` events drawn from the route mix. With a rate, arrivals
+    are open-loop Poisson at `rate` per second; otherwise each of the
+    `concurrency` workers sends back to back.
+    """
+    results = {route: [] for route in routes}
+    statuses = {route: {} for route in routes}
+    lock = threading.Lock()
+    plan = random.choices(routes, weights=[weights[route] for route in routes], k=requests)
+
+    def run(route):
+        latency, status, size = invoke(route)
+        with lock:
+            results[route].append((latency, size))
+            statuses[route][status] = statuses[route].get(status, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = []
+        next_arrival = started
+        for route in plan:
+            if rate:
+                next_arrival += random.expovariate(rate)
+                delay = next_arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            futures.append(executor.submit(run, route))
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    return results, statuses, elapsed
+
+def measure_memory(routes, samples):
+    """
+    Peak traced allocation above baseline while serving each route alone
+    """
+    peaks = {}
+    tracemalloc.start()
+    try:
+        for route in routes:
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            for _ in range(samples):
+                invoke(route)
+            peaks[route] = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+def build_report(results, statuses, elapsed, memory):
+    report = {'elapsed_s': round(elapsed, 3), 'routes': {}}
+    total = 0
+    for route, samples in results.items():
+        if not samples:
+            continue
+        latencies = sorted(latency for latency, _ in samples)
+        total += len(samples)
+        report['routes'][route] = {
+            'requests': len(samples),
+            'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else 0,
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'max_ms': round(latencies[-1] * 1000, 3),
+            'avg_body_bytes': int(sum(size for _, size in samples) / len(samples)),
+            'peak_memory_kb': round(memory.get(route, 0) / 1024, 1),
+            'status_codes': statuses[route]
+        }
+    report['total_requests'] = total
+    report['throughput_rps'] = round(total / elapsed, 1) if elapsed else 0
+    # ru_maxrss is kilobytes on Linux
+    report['process_max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return report
+
+def print_report(report):
+    print(f"{'route':<22}{'reqs':>7}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'body B':>10}{'peak KB':>10}")
+    for route, stats in report['routes'].items():
+        print(
+            f"{route:<22}{stats['requests']:>7}{stats['throughput_rps']:>9}{stats['p50_ms']:>10}"
+            f"{stats['p95_ms']:>10}{stats['p99_ms']:>10}{stats['avg_body_bytes']:>10}{stats['peak_memory_kb']:>10}"
+        )
+    print(f"\nTotal: {report['total_requests']} requests in {report['elapsed_s']}s "
+          f"({report['throughput_rps']} req/s), max RSS {report['process_max_rss_kb']} KB")
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay API Gateway events against the Daily Uplift SMS handlers')
+    parser.add_argument('--requests', type=int, default=2000, help='Total requests to replay')
+    parser.add_argument('--concurrency', type=int, default=8, help='Maximum requests in flight')
+    parser.add_argument('--rate', type=float, default=0, help='Arrival rate in requests/second (0 = as fast as possible)')
+    parser.add_argument('--routes', nargs='+', choices=sorted(ROUTES), default=sorted(ROUTES), help='Routes to include')
+    parser.add_argument('--subscribers', type=int, default=1000, help='Subscribers to seed')
+    parser.add_argument('--analytics', type=int, default=5000, help='Analytics rows to seed')
+    parser.add_argument('--publish-latency-ms', type=float, default=20, help='Simulated SNS publish latency')
+    parser.add_argument('--memory-samples', type=int, default=20, help='Requests per route for the memory pass')
+    parser.add_argument('--seed', type=int, help='Random seed for a reproducible run')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    dynamodb = LocalDynamoDB()
+    sns = LocalSNS(args.publish_latency_ms / 1000)
+    api_handler.dynamodb = dynamodb
+    analytics_compaction.dynamodb = dynamodb
+    subscriber_cache.dynamodb = dynamodb
+    api_handler.sns = sns
+    opt_out.sns = sns
+    seed(dynamodb, args.subscribers, args.analytics)
+
+    results, statuses, elapsed = run_load(args.routes, DEFAULT_WEIGHTS, args.requests, args.concurrency, args.rate)
+    memory = measure_memory(args.routes, args.memory_samples)
+    report = build_report(results, statuses, elapsed, memory)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+if __name__ == "__main__":
+    main()
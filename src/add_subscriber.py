@@ -2,6 +2,7 @@
 import boto3
 import argparse
 import sys
+from phone_numbers import DEFAULT_COUNTRY, normalize
 
 def subscribe_phone_number(topic_arn, phone_number):
     """
@@ -25,12 +26,15 @@ def main():
     parser = argparse.ArgumentParser(description='Subscribe a phone number to Daily Uplift SMS')
     parser.add_argument('--topic-arn', required=True, help='SNS Topic ARN')
     parser.add_argument('--phone', required=True, help='Phone number with country code (e.g., +12345678901)')
+    parser.add_argument('--country', default=DEFAULT_COUNTRY, help='Country for numbers without a country code (e.g., IN)')
     
     args = parser.parse_args()
     
-    # Validate phone number format (basic check)
-    if not args.phone.startswith('+'):
-        print("Error: Phone number must include country code and start with '+' (e.g., +12345678901)")
+    # Validate and canonicalize the phone number
+    try:
+        args.phone = normalize(args.phone, args.country)
+    except ValueError as e:
+        print(f"Error: {str(e)}. Include the country code (e.g., +12345678901) or pass --country")
         sys.exit(1)
     
     success = subscribe_phone_number(args.topic_arn, args.phone)
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""Compact raw analytics rows into daily rollup objects and expire them with TTL"""
+import gzip
+import json
+import os
+import sys
+import time
+import uuid
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+import boto3
+from boto3.dynamodb.conditions import Attr
+from dynamo_batch import batch_execute
+from delivery_status import LatencyHistogram
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Initialize clients
+s3 = boto3.client('s3')
+dynamodb = boto3.resource('dynamodb')
+
+# Get environment variables
+ANALYTICS_TABLE = os.environ.get('ANALYTICS_TABLE')
+ANALYTICS_ARCHIVE_BUCKET = os.environ.get('ANALYTICS_ARCHIVE_BUCKET')
+ANALYTICS_ARCHIVE_PREFIX = os.environ.get('ANALYTICS_ARCHIVE_PREFIX', 'rollups/')
+ANALYTICS_ARCHIVE_DIR = os.environ.get('ANALYTICS_ARCHIVE_DIR')
+COMPACT_AFTER_DAYS = int(os.environ.get('COMPACT_AFTER_DAYS', '7'))
+# Marked rows must outlive a failed run until the next run recounts them
+ROLLUP_TTL_SECONDS = int(os.environ.get('ROLLUP_TTL_SECONDS', '259200'))
+
+# Attributes a rollup needs from each raw row (including delivery outcomes
+# written by delivery_status), plus the run that marked it
+ROW_FIELDS = [
+    'message_id', 'timestamp', 'category', 'segments', 'custom',
+    'delivery_status', 'carrier_ms', 'price_usd', 'rolled_up'
+]
+
+# Rows are marked and counted this many at a time
+MARK_CHUNK_SIZE = 1000
+
+def archive_enabled():
+    """
+    Whether a rollup archive (S3 bucket or local directory) is configured
+    """
+    return bool(ANALYTICS_ARCHIVE_BUCKET or ANALYTICS_ARCHIVE_DIR)
+
+def empty_rollup(day):
+    return {
+        'date': day,
+        'total_messages': 0,
+        'total_segments': 0,
+        'custom_messages': 0,
+        'category_counts': {},
+        'category_segments': {},
+        'hour_counts': {},
+        'delivered_counts': {},
+        'failed_counts': {},
+        'cost_micros': {},
+        'carrier_latency': {}
+    }
+
+def add_row(rollup, item):
+    """
+    Fold one raw analytics row into a daily rollup
+    """
+    category = item.get('category', 'unknown')
+    segments = int(item.get('segments', 1))
+    hour = item.get('timestamp', '')[11:13] or 'unknown'
+    rollup['total_messages'] += 1
+    rollup['total_segments'] += segments
+    if item.get('custom'):
+        rollup['custom_messages'] += 1
+    rollup['category_counts'][category] = rollup['category_counts'].get(category, 0) + 1
+    rollup['category_segments'][category] = rollup['category_segments'].get(category, 0) + segments
+    rollup['hour_counts'][hour] = rollup['hour_counts'].get(hour, 0) + 1
+
+    # Delivery outcomes, on rows whose delivery-status log has been ingested
+    status = item.get('delivery_status')
+    if status:
+        counts = rollup['delivered_counts'] if status == 'DELIVERED' else rollup['failed_counts']
+        counts[category] = counts.get(category, 0) + 1
+    if item.get('price_usd') is not None:
+        micros = round(float(item['price_usd']) * 1000000)
+        rollup['cost_micros'][category] = rollup['cost_micros'].get(category, 0) + micros
+    if item.get('carrier_ms') is not None:
+        # String keys, as they come back from JSON
+        bucket = str(LatencyHistogram.bucket(float(item['carrier_ms'])))
+        rollup['carrier_latency'][bucket] = rollup['carrier_latency'].get(bucket, 0) + 1
+
+def merge_rollups(target, source):
+    """
+    Add the counts of `source` into `target`
+    """
+    for field in ('total_messages', 'total_segments', 'custom_messages'):
+        target[field] += source.get(field, 0)
+    for field in (
+        'category_counts', 'category_segments', 'hour_counts',
+        'delivered_counts', 'failed_counts', 'cost_micros', 'carrier_latency'
+    ):
+        for key, count in source.get(field, {}).items():
+            target[field][key] = target[field].get(key, 0) + count
+
+def delivery_summary(rollup):
+    """
+    Delivery rate and cost per category, and carrier latency percentiles, from a rollup
+    """
+    categories = sorted(set(rollup['delivered_counts']) | set(rollup['failed_counts']) | set(rollup['cost_micros']))
+    by_category = {}
+    for category in categories:
+        delivered = rollup['delivered_counts'].get(category, 0)
+        failed = rollup['failed_counts'].get(category, 0)
+        by_category[category] = {
+            'delivered': delivered,
+            'failed': failed,
+            'delivery_rate': round(delivered / (delivered + failed), 4) if delivered + failed else None,
+            'cost_usd': round(rollup['cost_micros'].get(category, 0) / 1000000, 6)
+        }
+    return {
+        'by_category': by_category,
+        'carrier_latency_ms': LatencyHistogram.from_counts(rollup['carrier_latency']).summary()
+    }
+
+# Archive layout: each run writes one part per date it counted rows for,
+# <date>/<run_id>.json.gz, and then runs/<run_id>.json once all its parts are
+# written. Only parts of completed runs are read, so a run that fails midway
+# adds nothing and the next run recounts its rows.
+def _location(name):
+    if ANALYTICS_ARCHIVE_BUCKET:
+        return f"{ANALYTICS_ARCHIVE_PREFIX}{name}"
+    return os.path.join(ANALYTICS_ARCHIVE_DIR, *name.split('/'))
+
+def _read_object(name):
+    location = _location(name)
+    if ANALYTICS_ARCHIVE_BUCKET:
+        return s3.get_object(Bucket=ANALYTICS_ARCHIVE_BUCKET, Key=location)['Body'].read()
+    with open(location, 'rb') as f:
+        return f.read()
+
+def _write_object(name, data, content_type):
+    location = _location(name)
+    if ANALYTICS_ARCHIVE_BUCKET:
+        extra = {'ContentEncoding': 'gzip'} if name.endswith('.gz') else {}
+        s3.put_object(Bucket=ANALYTICS_ARCHIVE_BUCKET, Key=location, Body=data, ContentType=content_type, **extra)
+    else:
+        os.makedirs(os.path.dirname(location), exist_ok=True)
+        tmp_path = f"{location}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, location)
+
+def _list_names(directory):
+    """
+    Names of the objects directly under an archive directory such as '2025-06-01'
+    """
+    if not ANALYTICS_ARCHIVE_BUCKET:
+        path = _location(directory)
+        return [name for name in os.listdir(path) if not name.endswith('.tmp')] if os.path.isdir(path) else []
+    prefix = _location(f"{directory}/")
+    names = []
+    list_kwargs = {'Bucket': ANALYTICS_ARCHIVE_BUCKET, 'Prefix': prefix}
+    while True:
+        response = s3.list_objects_v2(**list_kwargs)
+        names.extend(item['Key'][len(prefix):] for item in response.get('Contents', []))
+        if not response.get('IsTruncated'):
+            break
+        list_kwargs['ContinuationToken'] = response['NextContinuationToken']
+    return names
+
+def completed_runs():
+    """
+    Ids of the compaction runs that finished writing all their parts
+    """
+    return {name[:-len('.json')] for name in _list_names('runs') if name.endswith('.json')}
+
+def read_rollup(day, completed=None):
+    """
+    Sum the parts of completed runs for a date (YYYY-MM-DD), or None if there are none
+    """
+    if completed is None:
+        completed = completed_runs()
+    rollup = None
+    for name in _list_names(day):
+        if name[:-len('.json.gz')] not in completed:
+            continue
+        if rollup is None:
+            rollup = empty_rollup(day)
+        merge_rollups(rollup, json.loads(gzip.decompress(_read_object(f"{day}/{name}"))))
+    return rollup
+
+def write_rollup(rollup, run_id):
+    """
+    Write one run's counts for a date as a compressed part
+    """
+    data = gzip.compress(json.dumps(rollup, separators=(',', ':')).encode('utf-8'))
+    _write_object(f"{rollup['date']}/{run_id}.json.gz", data, 'application/json')
+
+def load_rollups(start_day, end_day):
+    """
+    Combine the rollups for every date from start_day to end_day inclusive
+    """
+    combined = empty_rollup(None)
+    combined['daily_counts'] = {}
+    completed = completed_runs()
+    days = [(start_day + timedelta(days=n)).isoformat() for n in range((end_day - start_day).days + 1)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for rollup in executor.map(lambda day: read_rollup(day, completed), days):
+            if rollup:
+                merge_rollups(combined, rollup)
+                combined['daily_counts'][rollup['date']] = rollup['total_messages']
+    return combined
+
+def iter_uncompacted_rows(before_day=None, since_day=None, include_marked=False):
+    """
+    Stream analytics rows that are not yet rolled up, optionally limited to a
+    date range. With include_marked, rows already marked by a run are
+    included too so the caller can check whether that run completed.
+    """
+    table = dynamodb.Table(ANALYTICS_TABLE)
+    conditions = [] if include_marked else [Attr('rolled_up').not_exists()]
+    if before_day:
+        conditions.append(Attr('timestamp').lt(before_day.isoformat()))
+    if since_day:
+        conditions.append(Attr('timestamp').gte(since_day.isoformat()))
+    scan_kwargs = {
+        'ProjectionExpression': ', '.join(f'#f{i}' for i in range(len(ROW_FIELDS))),
+        'ExpressionAttributeNames': {f'#f{i}': field for i, field in enumerate(ROW_FIELDS)}
+    }
+    if conditions:
+        condition = conditions[0]
+        for extra in conditions[1:]:
+            condition = condition & extra
+        scan_kwargs['FilterExpression'] = condition
+    while True:
+        response = table.scan(**scan_kwargs)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def _mark_rolled_up(items, run_id, expires_at):
+    """
+    Claim rows for this run, conditionally so a row is only ever claimed once
+    (or reclaimed from the unfinished run that marked it). Returns the ids of
+    the rows claimed.
+    """
+    statements = []
+    for item in items:
+        update = f'UPDATE "{ANALYTICS_TABLE}" SET "rolled_up" = ? SET "expires_at" = ? WHERE "message_id" = ?'
+        parameters = [{'S': run_id}, {'N': str(expires_at)}, {'S': item['message_id']}]
+        if item.get('rolled_up'):
+            statements.append((f'{update} AND "rolled_up" = ?', parameters + [{'S': item['rolled_up']}]))
+        else:
+            statements.append((f'{update} AND "rolled_up" IS MISSING', parameters))
+    failed = batch_execute(dynamodb.meta.client, statements)
+    if failed:
+        # One retry for throttling; rows claimed elsewhere fail again and are left alone
+        failed = batch_execute(dynamodb.meta.client, failed)
+    unclaimed = {parameters[2]['S'] for _, parameters in failed}
+    return {item['message_id'] for item in items} - unclaimed
+
+def compact(older_than_days=COMPACT_AFTER_DAYS, today=None):
+    """
+    Fold rows older than `older_than_days` into per-date rollup parts and
+    expire them with a TTL. Rows are claimed with this run's id before they
+    are counted, and only claimed rows go into the parts, so rows are never
+    counted twice. Rows claimed by a run that never completed are reclaimed
+    and counted here. Refuses to run without an archive, since rows it
+    claimed would expire without ever being rolled up.
+    """
+    if not archive_enabled():
+        raise ValueError('ANALYTICS_ARCHIVE_BUCKET or ANALYTICS_ARCHIVE_DIR is required')
+    cutoff = (today or date.today()) - timedelta(days=older_than_days)
+    run_id = f"{datetime.utcnow():%Y%m%dT%H%M%SZ}-{uuid.uuid4().hex[:8]}"
+    completed = completed_runs()
+    expires_at = int(time.time()) + ROLLUP_TTL_SECONDS
+    rollups = {}
+    report = {'run_id': run_id, 'rows': 0, 'recovered_rows': 0, 'unmarked_rows': 0, 'cutoff': cutoff.isoformat()}
+
+    def claim(chunk):
+        claimed = _mark_rolled_up(chunk, run_id, expires_at)
+        report['unmarked_rows'] += len(chunk) - len(claimed)
+        for item in chunk:
+            if item['message_id'] not in claimed:
+                continue
+            day = item.get('timestamp', '')[:10] or 'unknown'
+            if day not in rollups:
+                rollups[day] = empty_rollup(day)
+            add_row(rollups[day], item)
+            report['rows'] += 1
+            if item.get('rolled_up'):
+                report['recovered_rows'] += 1
+
+    # Memory is bounded by the number of dates plus one chunk of rows
+    chunk = []
+    for item in iter_uncompacted_rows(cutoff, include_marked=True):
+        if item.get('rolled_up') in completed:
+            continue
+        chunk.append(item)
+        if len(chunk) >= MARK_CHUNK_SIZE:
+            claim(chunk)
+            chunk = []
+    if chunk:
+        claim(chunk)
+
+    for day, rollup in sorted(rollups.items()):
+        write_rollup(rollup, run_id)
+    report['dates'] = sorted(rollups)
+    # Written last: until it exists none of this run's parts are read
+    _write_object(f"runs/{run_id}.json", json.dumps(report).encode('utf-8'), 'application/json')
+
+    logger.info(json.dumps({'analytics_compaction': report}))
+    return report
+
+def lambda_handler(event, context):
+    """
+    Scheduled entry point
+    """
+    try:
+        days = int(event.get('older_than_days', COMPACT_AFTER_DAYS))
+        return {
+            'statusCode': 200,
+            'body': json.dumps(compact(days))
+        }
+    except Exception as e:
+        logger.error(f"Error compacting analytics: {str(e)}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps(f'Error: {str(e)}')
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description='Compact Daily Uplift SMS analytics into daily rollups')
+    parser.add_argument('--older-than-days', type=int, default=COMPACT_AFTER_DAYS, help='Only compact rows older than this')
+    parser.add_argument('--show', help='Print the rollup for a date (YYYY-MM-DD) instead of compacting')
+
+    args = parser.parse_args()
+
+    if not archive_enabled():
+        print("Error: ANALYTICS_ARCHIVE_BUCKET or ANALYTICS_ARCHIVE_DIR is required")
+        sys.exit(1)
+
+    if args.show:
+        print(json.dumps(read_rollup(args.show), indent=2))
+        return
+
+    print(json.dumps(compact(args.older_than_days), indent=2))
+
+if __name__ == "__main__":
+    main()
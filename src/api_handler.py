@@ -1,8 +1,14 @@
-import json
 import boto3
 import os
 import logging
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from sms_encoding import analyze, normalize_to_gsm
+from opt_out import is_opted_out
+from phone_numbers import DEFAULT_COUNTRY, normalize
+from api_response import decode_cursor, encode_cursor, json_response, ndjson_response, parse_body, wants_ndjson
+from analytics_compaction import (
+    archive_enabled, add_row, delivery_summary, empty_rollup, iter_uncompacted_rows, load_rollups, merge_rollups
+)
 
 # Configure logging
 logger = logging.getLogger()
@@ -16,53 +22,71 @@ dynamodb = boto3.resource('dynamodb')
 SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')
 SUBSCRIBERS_TABLE = os.environ.get('SUBSCRIBERS_TABLE')
 ANALYTICS_TABLE = os.environ.get('ANALYTICS_TABLE')
+MAX_CUSTOM_SEGMENTS = int(os.environ.get('MAX_CUSTOM_SEGMENTS', '4'))
+# GET /subscribers is paged to stay under Lambda's 6 MB response limit
+SUBSCRIBERS_PAGE_SIZE = int(os.environ.get('SUBSCRIBERS_PAGE_SIZE', '1000'))
+SUBSCRIBERS_MAX_PAGE_SIZE = int(os.environ.get('SUBSCRIBERS_MAX_PAGE_SIZE', '5000'))
 
-def get_subscribers():
+# Attributes the dashboard shows; the rest (ARNs, rotation cursors) are only returned with ?fields=all
+SUBSCRIBER_FIELDS = ['phone_number', 'preferred_category', 'active', 'created_at']
+
+def get_subscribers_page(all_fields=False, limit=SUBSCRIBERS_PAGE_SIZE, cursor=None):
     """
-    Get all subscribers from DynamoDB
+    Get up to `limit` subscribers starting at `cursor`, with the cursor of the
+    next page (None on the last page). Raises ValueError for a bad cursor.
     """
-    try:
-        table = dynamodb.Table(SUBSCRIBERS_TABLE)
-        response = table.scan()
-        return response.get('Items', [])
-    except Exception as e:
-        logger.error(f"Error getting subscribers: {str(e)}")
-        return []
+    table = dynamodb.Table(SUBSCRIBERS_TABLE)
+    scan_kwargs = {}
+    if not all_fields:
+        scan_kwargs['ProjectionExpression'] = ', '.join(f'#f{i}' for i in range(len(SUBSCRIBER_FIELDS)))
+        scan_kwargs['ExpressionAttributeNames'] = {f'#f{i}': field for i, field in enumerate(SUBSCRIBER_FIELDS)}
+    if cursor:
+        start_key = decode_cursor(cursor)
+        if set(start_key) != {'phone_number'}:
+            raise ValueError('Invalid cursor')
+        scan_kwargs['ExclusiveStartKey'] = start_key
+    subscribers = []
+    while True:
+        response = table.scan(Limit=limit - len(subscribers), **scan_kwargs)
+        subscribers.extend(response.get('Items', []))
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key or len(subscribers) >= limit:
+            break
+        scan_kwargs['ExclusiveStartKey'] = last_key
+    return subscribers, encode_cursor(last_key) if last_key else None
 
 def get_analytics(days=30):
     """
-    Get analytics data from DynamoDB
+    Get analytics for the last `days` days: rows still in DynamoDB plus the
+    daily rollups that older rows were compacted into
     """
     try:
-        table = dynamodb.Table(ANALYTICS_TABLE)
-        response = table.scan()
-        items = response.get('Items', [])
-        
-        # Process analytics data
-        category_counts = {}
+        today = date.today()
+        start = today - timedelta(days=days)
+        totals = empty_rollup(None)
         daily_counts = {}
         
-        for item in items:
-            # Count by category
-            category = item.get('category', 'unknown')
-            if category in category_counts:
-                category_counts[category] += 1
-            else:
-                category_counts[category] = 1
-                
-            # Count by day
-            timestamp = item.get('timestamp', '')
-            if timestamp:
-                date = timestamp.split('T')[0]  # Extract date part
-                if date in daily_counts:
-                    daily_counts[date] += 1
-                else:
-                    daily_counts[date] = 1
+        # Recent rows that have not been compacted yet
+        for item in iter_uncompacted_rows(since_day=start):
+            add_row(totals, item)
+            day = item.get('timestamp', '').split('T')[0]
+            daily_counts[day] = daily_counts.get(day, 0) + 1
+        
+        # Older days, one rollup object per date
+        if archive_enabled():
+            rollups = load_rollups(start, today)
+            merge_rollups(totals, rollups)
+            for day, count in rollups['daily_counts'].items():
+                daily_counts[day] = daily_counts.get(day, 0) + count
         
         return {
-            'category_counts': category_counts,
+            'category_counts': totals['category_counts'],
             'daily_counts': daily_counts,
-            'total_messages': len(items)
+            'hour_counts': totals['hour_counts'],
+            'category_segments': totals['category_segments'],
+            'total_messages': totals['total_messages'],
+            'total_segments': totals['total_segments'],
+            'delivery': delivery_summary(totals)
         }
     except Exception as e:
         logger.error(f"Error getting analytics: {str(e)}")
@@ -82,6 +106,15 @@ def manage_subscriber(data):
                 'message': 'Missing required parameters'
             }
         
+        # Canonicalize so one number is never stored under two spellings
+        try:
+            phone = normalize(phone, data.get('country') or DEFAULT_COUNTRY)
+        except ValueError as e:
+            return {
+                'success': False,
+                'message': str(e)
+            }
+        
         table = dynamodb.Table(SUBSCRIBERS_TABLE)
         
         if action == 'add':
@@ -133,19 +166,19 @@ def manage_subscriber(data):
             }
             
         elif action == 'remove':
-            # Get subscription ARN
-            subscriber = table.get_item(Key={'phone_number': phone}).get('Item')
-            if subscriber and 'subscription_arn' in subscriber:
-                # Unsubscribe from SNS
-                sns.unsubscribe(SubscriptionArn=subscriber['subscription_arn'])
-            
-            # Mark as inactive in DynamoDB
-            table.update_item(
+            # Mark as inactive in DynamoDB, reading the subscription ARN in the same call
+            response = table.update_item(
                 Key={'phone_number': phone},
                 UpdateExpression="set active = :a",
-                ExpressionAttributeValues={':a': False}
+                ExpressionAttributeValues={':a': False},
+                ReturnValues='ALL_OLD'
             )
             
+            subscriber = response.get('Attributes', {})
+            if 'subscription_arn' in subscriber:
+                # Unsubscribe from SNS
+                sns.unsubscribe(SubscriptionArn=subscriber['subscription_arn'])
+            
             return {
                 'success': True,
                 'message': f'Subscriber {phone} removed successfully'
@@ -177,6 +210,37 @@ def send_message(data):
                 'message': 'Missing required parameters'
             }
         
+        # Reject malformed numbers before they cost a publish
+        try:
+            phone = normalize(phone, data.get('country') or DEFAULT_COUNTRY)
+        except ValueError as e:
+            return {
+                'success': False,
+                'message': str(e)
+            }
+        
+        # SNS rejects SMS to numbers that replied STOP
+        if is_opted_out(phone):
+            return {
+                'success': False,
+                'message': f'{phone} has opted out of SMS'
+            }
+        
+        # Optionally replace typographic characters that force UCS-2
+        if data.get('normalize'):
+            message = normalize_to_gsm(message)
+        
+        # Validate encoding and segment count
+        info = analyze(message)
+        if info.segments > MAX_CUSTOM_SEGMENTS:
+            return {
+                'success': False,
+                'message': f'Message is {info.segments} {info.encoding} segments; the limit is {MAX_CUSTOM_SEGMENTS}',
+                'encoding': info.encoding,
+                'segments': info.segments,
+                'non_gsm_characters': list(info.non_gsm)
+            }
+        
         # Send the message
         response = sns.publish(
             PhoneNumber=phone,
@@ -197,13 +261,17 @@ def send_message(data):
                 'timestamp': datetime.utcnow().isoformat(),
                 'category': category,
                 'subscriber_count': 1,
+                'segments': info.segments,
                 'custom': True
             })
         
         return {
             'success': True,
             'message': f'Message sent to {phone} successfully',
-            'message_id': response['MessageId']
+            'message_id': response['MessageId'],
+            'encoding': info.encoding,
+            'segments': info.segments,
+            'non_gsm_characters': list(info.non_gsm)
         }
     except Exception as e:
         logger.error(f"Error sending message: {str(e)}")
@@ -222,65 +290,60 @@ def lambda_handler(event, context):
         http_method = event.get('httpMethod', '')
         
         # Parse request body if present
-        body = {}
-        if 'body' in event and event['body']:
-            body = json.loads(event['body'])
+        body = parse_body(event)
+        query = event.get('queryStringParameters') or {}
         
         # Handle different endpoints
         if path == '/subscribers':
             if http_method == 'GET':
-                # Get all subscribers
-                subscribers = get_subscribers()
-                return {
-                    'statusCode': 200,
-                    'body': json.dumps({
-                        'subscribers': subscribers,
-                        'count': len(subscribers)
-                    })
-                }
+                all_fields = query.get('fields') == 'all'
+                try:
+                    limit = min(max(int(query.get('limit', SUBSCRIBERS_PAGE_SIZE)), 1), SUBSCRIBERS_MAX_PAGE_SIZE)
+                except ValueError:
+                    limit = SUBSCRIBERS_PAGE_SIZE
+                try:
+                    subscribers, next_cursor = get_subscribers_page(all_fields, limit, query.get('cursor'))
+                except ValueError as e:
+                    return json_response(event, 400, {'message': str(e)})
+                
+                if wants_ndjson(event):
+                    # One subscriber per line; the next page's cursor goes in a header
+                    headers = {'X-Next-Cursor': next_cursor} if next_cursor else None
+                    return ndjson_response(event, 200, subscribers, headers)
+                
+                return json_response(event, 200, {
+                    'subscribers': subscribers,
+                    'count': len(subscribers),
+                    'next_cursor': next_cursor
+                })
             elif http_method == 'POST':
                 # Manage subscriber
                 result = manage_subscriber(body)
                 status_code = 200 if result['success'] else 400
-                return {
-                    'statusCode': status_code,
-                    'body': json.dumps(result)
-                }
+                return json_response(event, status_code, result)
         
         elif path == '/analytics':
             if http_method == 'GET':
                 # Get analytics data
-                days = event.get('queryStringParameters', {}).get('days', 30)
+                days = query.get('days', 30)
                 try:
                     days = int(days)
                 except:
                     days = 30
                     
                 analytics = get_analytics(days)
-                return {
-                    'statusCode': 200,
-                    'body': json.dumps(analytics)
-                }
+                return json_response(event, 200, analytics)
         
         elif path == '/send':
             if http_method == 'POST':
                 # Send custom message
                 result = send_message(body)
                 status_code = 200 if result['success'] else 400
-                return {
-                    'statusCode': status_code,
-                    'body': json.dumps(result)
-                }
+                return json_response(event, status_code, result)
         
         # Invalid endpoint
-        return {
-            'statusCode': 404,
-            'body': json.dumps({'message': 'Not found'})
-        }
+        return json_response(event, 404, {'message': 'Not found'})
         
     except Exception as e:
         logger.error(f"Error handling request: {str(e)}")
-        return {
-            'statusCode': 500,
-            'body': json.dumps({'message': f'Error: {str(e)}'})
-        }
\ No newline at end of file
+        return json_response(event, 500, {'message': f'Error: {str(e)}'})
\ No newline at end of file
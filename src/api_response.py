@@ -0,0 +1,137 @@
+"""Compressed JSON and NDJSON responses for the Daily Uplift SMS API"""
+import base64
+import gzip
+import json
+import os
+import zlib
+from decimal import Decimal
+
+# orjson is optional; it serializes several times faster when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Get environment variables
+GZIP_MIN_BYTES = int(os.environ.get('GZIP_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '5'))
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+def _default(value):
+    """
+    Serialize the Decimal values boto3 returns for DynamoDB numbers
+    """
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(payload):
+    """
+    Serialize a payload to compact UTF-8 JSON bytes
+    """
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default)
+    return json.dumps(payload, default=_default, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+def _header(event, name):
+    """
+    Case-insensitive request header lookup
+    """
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value or ''
+    return ''
+
+def accepts_gzip(event):
+    """
+    Check whether the client sent Accept-Encoding: gzip
+    """
+    for coding in _header(event, 'Accept-Encoding').split(','):
+        parts = coding.strip().split(';')
+        if parts[0].strip().lower() in ('gzip', '*'):
+            # Honour an explicit q=0 refusal
+            return not any(p.strip().replace(' ', '') in ('q=0', 'q=0.0') for p in parts[1:])
+    return False
+
+def wants_ndjson(event):
+    """
+    Check whether the client asked for NDJSON via Accept or ?format=ndjson
+    """
+    query = event.get('queryStringParameters') or {}
+    return query.get('format') == 'ndjson' or NDJSON_CONTENT_TYPE in _header(event, 'Accept')
+
+def parse_body(event):
+    """
+    Parse a JSON request body, decoding it first if API Gateway base64-encoded it
+    """
+    body = event.get('body')
+    if not body:
+        return {}
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body)
+    return json.loads(body)
+
+def encode_cursor(last_key):
+    """
+    Turn a DynamoDB LastEvaluatedKey into an opaque, URL-safe page cursor
+    """
+    return base64.urlsafe_b64encode(dumps(last_key)).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """
+    Turn a page cursor back into an ExclusiveStartKey, raising ValueError if it is not one
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (TypeError, ValueError) as e:
+        raise ValueError('Invalid cursor') from e
+    if not isinstance(key, dict):
+        raise ValueError('Invalid cursor')
+    return key
+
+def _response(status_code, content_type, body, compressed, extra_headers=None):
+    headers = {'Content-Type': content_type, 'Vary': 'Accept-Encoding'}
+    headers.update(extra_headers or {})
+    if compressed:
+        headers['Content-Encoding'] = 'gzip'
+        return {
+            'statusCode': status_code,
+            'headers': headers,
+            'body': base64.b64encode(body).decode('ascii'),
+            'isBase64Encoded': True
+        }
+    return {
+        'statusCode': status_code,
+        'headers': headers,
+        'body': body.decode('utf-8'),
+        'isBase64Encoded': False
+    }
+
+def json_response(event, status_code, payload):
+    """
+    Build a JSON response, gzip-compressed when the client accepts it and the body is large enough
+    """
+    body = dumps(payload)
+    if len(body) >= GZIP_MIN_BYTES and accepts_gzip(event):
+        return _response(status_code, 'application/json', gzip.compress(body, GZIP_LEVEL), True)
+    return _response(status_code, 'application/json', body, False)
+
+def ndjson_response(event, status_code, items, extra_headers=None):
+    """
+    Build an NDJSON response, one item per line. Lines are fed to the
+    compressor as they are serialized, so the uncompressed body is never
+    held in memory as a whole. The response itself is still buffered and
+    bound by Lambda's 6 MB proxy response limit, so large lists are paged.
+    """
+    if accepts_gzip(event):
+        # wbits=31 writes a gzip container
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        chunks = [compressor.compress(dumps(item) + b'\n') for item in items]
+        chunks.append(compressor.flush())
+        return _response(status_code, NDJSON_CONTENT_TYPE, b''.join(chunks), True, extra_headers)
+    body = b''.join(dumps(item) + b'\n' for item in items)
+    return _response(status_code, NDJSON_CONTENT_TYPE, body, False, extra_headers)
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""Ingest SNS SMS delivery-status logs into per-message outcomes and delivery aggregates"""
+import base64
+import gzip
+import io
+import json
+import math
+import os
+import sys
+import logging
+import argparse
+from collections import namedtuple
+import boto3
+from dynamo_batch import batch_execute, batch_get, GET_BATCH_SIZE
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Initialize clients
+s3 = boto3.client('s3')
+dynamodb = boto3.resource('dynamodb')
+
+# Get environment variables
+ANALYTICS_TABLE = os.environ.get('ANALYTICS_TABLE')
+DELIVERY_WRITE_OUTCOMES = os.environ.get('DELIVERY_WRITE_OUTCOMES', '').lower() in ('1', 'true', 'yes')
+
+# Outcome writes are buffered and applied in chunks, like reconciliation repairs
+OUTCOME_CHUNK_SIZE = 500
+
+Outcome = namedtuple('Outcome', ['message_id', 'delivered', 'timestamp', 'carrier_ms', 'device_ms', 'price_usd', 'provider_response'])
+
+def parse_line(line):
+    """
+    Parse one log line into a delivery-status record. CloudWatch exports put
+    a timestamp before the JSON, so parsing starts at the first '{'.
+    Returns None for lines that are not delivery-status records.
+    """
+    start = line.find('{')
+    if start < 0:
+        return None
+    try:
+        record = json.loads(line[start:])
+    except ValueError:
+        return None
+    if not isinstance(record, dict) or 'notification' not in record:
+        return None
+    return record
+
+def parse_outcome(record):
+    """
+    Extract the fields we keep from a delivery-status record
+    """
+    notification = record.get('notification', {})
+    delivery = record.get('delivery', {})
+    message_id = notification.get('messageId')
+    if not message_id:
+        return None
+    return Outcome(
+        message_id=message_id,
+        delivered=record.get('status') == 'SUCCESS',
+        timestamp=notification.get('timestamp', ''),
+        carrier_ms=delivery.get('dwellTimeMs'),
+        device_ms=delivery.get('dwellTimeMsUntilDeviceAck'),
+        price_usd=delivery.get('priceInUSD'),
+        provider_response=delivery.get('providerResponse', '')
+    )
+
+def _open_text(raw, name):
+    if name.endswith('.gz'):
+        raw = gzip.GzipFile(fileobj=raw)
+    return io.TextIOWrapper(raw, encoding='utf-8', errors='replace')
+
+def iter_lines(source):
+    """
+    Stream log lines from a file, a directory of files, or an s3://bucket/prefix.
+    Gzip files (as CloudWatch Logs exports them) are decompressed on the fly.
+    """
+    if source.startswith('s3://'):
+        bucket, _, prefix = source[5:].partition('/')
+        paginator = s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                body = s3.get_object(Bucket=bucket, Key=obj['Key'])['Body']
+                yield from _open_text(body, obj['Key'])
+        return
+
+    if os.path.isdir(source):
+        paths = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(source)
+            for name in names
+        )
+    else:
+        paths = [source]
+    for path in paths:
+        with open(path, 'rb') as raw:
+            yield from _open_text(raw, path)
+
+class LatencyHistogram:
+    """
+    Log-bucketed latency histogram: constant memory per group, and
+    percentiles accurate to within one 10% bucket
+    """
+
+    GROWTH = 1.1
+
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+
+    @classmethod
+    def bucket(cls, ms):
+        return 0 if ms <= 1 else math.ceil(math.log(ms) / math.log(cls.GROWTH))
+
+    @classmethod
+    def from_counts(cls, counts):
+        """
+        Rebuild a histogram from {bucket: count}, e.g. as stored in a JSON rollup
+        """
+        histogram = cls()
+        for bucket, count in counts.items():
+            histogram.counts[int(bucket)] = histogram.counts.get(int(bucket), 0) + count
+            histogram.total += count
+        return histogram
+
+    def add(self, ms):
+        bucket = self.bucket(ms)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total += 1
+
+    def merge(self, other):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.total += other.total
+
+    def percentile(self, p):
+        if not self.total:
+            return None
+        rank = math.ceil(self.total * p / 100)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return round(self.GROWTH ** bucket)
+
+    def summary(self):
+        return {f'p{p}': self.percentile(p) for p in (50, 90, 99)}
+
+class DeliveryStats:
+    """
+    Delivery counts, latency, and cost for one group of messages
+    """
+
+    def __init__(self):
+        self.messages = 0
+        self.delivered = 0
+        self.price_micros = 0
+        self.carrier_latency = LatencyHistogram()
+        self.device_latency = LatencyHistogram()
+        self.failure_reasons = {}
+
+    def add(self, outcome):
+        self.messages += 1
+        if outcome.delivered:
+            self.delivered += 1
+        else:
+            reason = outcome.provider_response or 'unknown'
+            self.failure_reasons[reason] = self.failure_reasons.get(reason, 0) + 1
+        if outcome.price_usd is not None:
+            self.price_micros += round(float(outcome.price_usd) * 1000000)
+        if outcome.carrier_ms is not None:
+            self.carrier_latency.add(outcome.carrier_ms)
+        if outcome.device_ms is not None:
+            self.device_latency.add(outcome.device_ms)
+
+    def merge(self, other):
+        self.messages += other.messages
+        self.delivered += other.delivered
+        self.price_micros += other.price_micros
+        self.carrier_latency.merge(other.carrier_latency)
+        self.device_latency.merge(other.device_latency)
+        for reason, count in other.failure_reasons.items():
+            self.failure_reasons[reason] = self.failure_reasons.get(reason, 0) + count
+
+    def as_dict(self):
+        return {
+            'messages': self.messages,
+            'delivered': self.delivered,
+            'failed': self.messages - self.delivered,
+            'delivery_rate': round(self.delivered / self.messages, 4) if self.messages else None,
+            'carrier_latency_ms': self.carrier_latency.summary(),
+            'device_latency_ms': self.device_latency.summary(),
+            'cost_usd': round(self.price_micros / 1000000, 6),
+            'failure_reasons': self.failure_reasons
+        }
+
+class TableLookup:
+    """
+    Resolve message ids to (category, date) from the analytics table, 100 keys per round trip
+    """
+
+    def __init__(self, table_name=ANALYTICS_TABLE):
+        self.table_name = table_name
+
+    def lookup(self, message_ids):
+        items = batch_get(
+            dynamodb, self.table_name, [{'message_id': message_id} for message_id in set(message_ids)],
+            projection='#id, #c, #ts', attribute_names={'#id': 'message_id', '#c': 'category', '#ts': 'timestamp'}
+        )
+        return {
+            item['message_id']: (item.get('category', 'unknown'), item.get('timestamp', '')[:10])
+            for item in items
+        }
+
+class RecordsLookup:
+    """
+    Resolve message ids from a JSON lines export of analytics rows
+    """
+
+    def __init__(self, path):
+        self.records = {}
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    self.records[item['message_id']] = (item.get('category', 'unknown'), item.get('timestamp', '')[:10])
+
+    def lookup(self, message_ids):
+        return {message_id: self.records[message_id] for message_id in message_ids if message_id in self.records}
+
+class OutcomeWriter:
+    """
+    Buffers per-message outcomes and writes them onto the matching analytics
+    rows as batched PartiQL updates
+    """
+
+    def __init__(self, client, table_name):
+        self.client = client
+        self.table_name = table_name
+        self.pending = []
+        self.written = 0
+        self.failures = 0
+
+    def add(self, outcome):
+        self.pending.append(outcome)
+        if len(self.pending) >= OUTCOME_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        statements = []
+        for outcome in self.pending:
+            assignments = ['SET "delivery_status" = ?']
+            parameters = [{'S': 'DELIVERED' if outcome.delivered else 'FAILED'}]
+            for attribute, value in (('carrier_ms', outcome.carrier_ms), ('price_usd', outcome.price_usd)):
+                if value is not None:
+                    assignments.append(f'SET "{attribute}" = ?')
+                    parameters.append({'N': str(value)})
+            parameters.append({'S': outcome.message_id})
+            statements.append((
+                f'UPDATE "{self.table_name}" {" ".join(assignments)} WHERE "message_id" = ?',
+                parameters
+            ))
+        failed = len(batch_execute(self.client, statements)) if statements else 0
+        self.written += len(statements) - failed
+        self.failures += failed
+        self.pending = []
+
+def ingest(lines, lookup, writer=None):
+    """
+    Stream delivery-status lines, join each to its analytics row by message id,
+    and aggregate per (category, date). Memory is bounded by the number of
+    groups, not the number of lines: records are joined 100 at a time.
+    """
+    groups = {}
+    counts = {'lines': 0, 'records': 0, 'matched': 0, 'unmatched': 0, 'skipped_lines': 0}
+    buffer = []
+
+    def drain():
+        resolved = lookup.lookup([outcome.message_id for outcome in buffer])
+        for outcome in buffer:
+            match = resolved.get(outcome.message_id)
+            if match:
+                counts['matched'] += 1
+                category, day = match
+                if writer:
+                    writer.add(outcome)
+            else:
+                counts['unmatched'] += 1
+                category, day = 'unmatched', outcome.timestamp[:10]
+            groups.setdefault((category, day or 'unknown'), DeliveryStats()).add(outcome)
+        buffer.clear()
+
+    for line in lines:
+        counts['lines'] += 1
+        record = parse_line(line)
+        outcome = parse_outcome(record) if record else None
+        if not outcome:
+            counts['skipped_lines'] += 1
+            continue
+        counts['records'] += 1
+        buffer.append(outcome)
+        if len(buffer) >= GET_BATCH_SIZE:
+            drain()
+    if buffer:
+        drain()
+    if writer:
+        writer.flush()
+
+    by_category = {}
+    for (category, _), stats in groups.items():
+        by_category.setdefault(category, DeliveryStats()).merge(stats)
+
+    report = dict(counts)
+    report['by_category'] = {category: stats.as_dict() for category, stats in sorted(by_category.items())}
+    report['by_day'] = [
+        dict(category=category, date=day, **stats.as_dict())
+        for (category, day), stats in sorted(groups.items(), key=lambda group: (group[0][1], group[0][0]))
+    ]
+    if writer:
+        report['outcomes_written'] = writer.written
+        report['outcome_failures'] = writer.failures
+    return report
+
+def iter_subscription_lines(event):
+    """
+    Decode the log events of a CloudWatch Logs subscription invocation
+    """
+    payload = json.loads(gzip.decompress(base64.b64decode(event['awslogs']['data'])))
+    for log_event in payload.get('logEvents', []):
+        yield log_event['message']
+
+def lambda_handler(event, context):
+    """
+    CloudWatch Logs subscription entry point for the SNS SMS delivery log groups
+    """
+    try:
+        writer = OutcomeWriter(dynamodb.meta.client, ANALYTICS_TABLE) if DELIVERY_WRITE_OUTCOMES else None
+        report = ingest(iter_subscription_lines(event), TableLookup(), writer)
+        logger.info(json.dumps({'delivery_status': report}))
+        return {
+            'statusCode': 200,
+            'body': json.dumps({key: report[key] for key in ('records', 'matched', 'unmatched')})
+        }
+    except Exception as e:
+        logger.error(f"Error ingesting delivery status logs: {str(e)}")
+        raise
+
+def print_report(report):
+    print(f"{report['records']} records from {report['lines']} lines "
+          f"({report['matched']} matched, {report['unmatched']} unmatched, {report['skipped_lines']} skipped)")
+    print(f"{'date':<12} {'category':<16} {'msgs':>8} {'rate':>7} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'cost $':>10}")
+    for group in report['by_day']:
+        latency = group['carrier_latency_ms']
+        print(f"{group['date']:<12} {group['category']:<16} {group['messages']:>8} "
+              f"{group['delivery_rate']:>7.2%} {latency['p50'] or '-':>8} {latency['p90'] or '-':>8} "
+              f"{latency['p99'] or '-':>8} {group['cost_usd']:>10.4f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingest SNS SMS delivery-status logs for Daily Uplift SMS')
+    parser.add_argument('sources', nargs='+', help='Log files, directories, or s3://bucket/prefix exports')
+    parser.add_argument('--records', help='JSON lines export of analytics rows to join against (default: ANALYTICS_TABLE)')
+    parser.add_argument('--write-outcomes', action='store_true', help='Store each outcome on its analytics row')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    args = parser.parse_args()
+
+    if not args.records and not ANALYTICS_TABLE:
+        print("Error: --records or ANALYTICS_TABLE is required")
+        sys.exit(1)
+    if args.write_outcomes and not ANALYTICS_TABLE:
+        print("Error: --write-outcomes requires ANALYTICS_TABLE")
+        sys.exit(1)
+
+    lookup = RecordsLookup(args.records) if args.records else TableLookup()
+    writer = OutcomeWriter(dynamodb.meta.client, ANALYTICS_TABLE) if args.write_outcomes else None
+    lines = (line for source in args.sources for line in iter_lines(source))
+    report = ingest(lines, lookup, writer)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+if __name__ == "__main__":
+    main()
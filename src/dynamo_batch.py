@@ -0,0 +1,64 @@
+"""Batched DynamoDB reads and writes for Daily Uplift SMS"""
+import time
+import logging
+
+# Configure logging
+logger = logging.getLogger()
+
+# BatchExecuteStatement accepts at most 25 statements per call
+BATCH_SIZE = 25
+
+# BatchGetItem accepts at most 100 keys per call
+GET_BATCH_SIZE = 100
+GET_MAX_RETRIES = 5
+
+def batch_execute(client, statements):
+    """
+    Run PartiQL write statements in batches of 25.
+    Each statement is a (statement, parameters) tuple; returns the failed ones.
+    """
+    failed = []
+    for start in range(0, len(statements), BATCH_SIZE):
+        chunk = statements[start:start + BATCH_SIZE]
+        try:
+            response = client.batch_execute_statement(Statements=[
+                {'Statement': statement, 'Parameters': parameters}
+                for statement, parameters in chunk
+            ])
+        except Exception as e:
+            logger.error(f"Error executing batch of {len(chunk)} statements: {str(e)}")
+            failed.extend(chunk)
+            continue
+
+        for statement, result in zip(chunk, response.get('Responses', [])):
+            if 'Error' in result:
+                failed.append(statement)
+
+    if failed:
+        logger.error(f"{len(failed)} of {len(statements)} batched statements failed")
+    return failed
+
+def batch_get(resource, table_name, keys, projection=None, attribute_names=None):
+    """
+    Fetch items by key in batches of 100, retrying unprocessed keys with backoff.
+    Returns the items found; keys with no item are simply absent.
+    """
+    items = []
+    for start in range(0, len(keys), GET_BATCH_SIZE):
+        request = {'Keys': keys[start:start + GET_BATCH_SIZE]}
+        if projection:
+            request['ProjectionExpression'] = projection
+        if attribute_names:
+            request['ExpressionAttributeNames'] = attribute_names
+        request_items = {table_name: request}
+        for attempt in range(GET_MAX_RETRIES + 1):
+            response = resource.batch_get_item(RequestItems=request_items)
+            items.extend(response.get('Responses', {}).get(table_name, []))
+            request_items = response.get('UnprocessedKeys') or {}
+            if not request_items:
+                break
+            time.sleep(0.05 * 2 ** attempt)
+        else:
+            unprocessed = len(request_items[table_name]['Keys'])
+            logger.error(f"{unprocessed} keys still unprocessed after {GET_MAX_RETRIES} retries")
+    return items
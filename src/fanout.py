@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""Queue-based fan-out for Daily Uplift SMS: a producer enqueues subscriber batches, workers send"""
+import json
+import os
+import sys
+import time
+import heapq
+import uuid
+import logging
+import argparse
+import threading
+from collections import deque
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from run_summary import RunSummary, mask_phone
+from subscriber_snapshot import iter_active_subscribers
+from lambda_function import (
+    MESSAGES, SUBSCRIBERS_TABLE, get_messages, iter_subscribers,
+    send_to_subscribers, broadcast_to_topic
+)
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Initialize clients
+sqs = boto3.client('sqs')
+
+# Get environment variables
+FANOUT_QUEUE_URL = os.environ.get('FANOUT_QUEUE_URL')
+FANOUT_BATCH_SIZE = int(os.environ.get('FANOUT_BATCH_SIZE', '50'))
+FANOUT_WORKER_THREADS = int(os.environ.get('FANOUT_WORKER_THREADS', '4'))
+FANOUT_MAX_ATTEMPTS = int(os.environ.get('FANOUT_MAX_ATTEMPTS', '3'))
+FANOUT_RETRY_DELAY_SECONDS = int(os.environ.get('FANOUT_RETRY_DELAY_SECONDS', '60'))
+
+def _json_default(value):
+    """
+    Serialize DynamoDB numbers in queue messages
+    """
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def encode_batch(subscribers, attempt=1):
+    """
+    Encode a batch of subscribers as a queue message body
+    """
+    return json.dumps({'attempt': attempt, 'subscribers': subscribers}, default=_json_default)
+
+def iter_batches(subscribers, batch_size=FANOUT_BATCH_SIZE):
+    """
+    Group a stream of subscribers into fixed-size batches
+    """
+    batch = []
+    for subscriber in subscribers:
+        batch.append(subscriber)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class SqsQueue:
+    """
+    Fan-out queue backed by Amazon SQS
+    """
+
+    def __init__(self, queue_url):
+        self.queue_url = queue_url
+
+    def send(self, bodies, delay_seconds=0):
+        # SendMessageBatch accepts at most 10 entries per call
+        for start in range(0, len(bodies), 10):
+            entries = [
+                {'Id': str(i), 'MessageBody': body, 'DelaySeconds': delay_seconds}
+                for i, body in enumerate(bodies[start:start + 10])
+            ]
+            response = sqs.send_message_batch(QueueUrl=self.queue_url, Entries=entries)
+            if response.get('Failed'):
+                raise RuntimeError(f"Failed to enqueue {len(response['Failed'])} batches")
+
+class MemoryQueue:
+    """
+    In-process fan-out queue with SQS-style visibility timeouts, for local runs
+    """
+
+    def __init__(self, visibility_timeout=30):
+        self.visibility_timeout = visibility_timeout
+        self.ready = deque()
+        self.delayed = []
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def send(self, bodies, delay_seconds=0):
+        with self.lock:
+            if delay_seconds <= 0:
+                self.ready.extend(bodies)
+                return
+            visible_at = time.monotonic() + delay_seconds
+            for body in bodies:
+                heapq.heappush(self.delayed, (visible_at, uuid.uuid4().hex, body))
+
+    def receive(self):
+        """
+        Claim the next visible message as (receipt, body), or None if there is none
+        """
+        with self.lock:
+            now = time.monotonic()
+            while self.delayed and self.delayed[0][0] <= now:
+                self.ready.append(heapq.heappop(self.delayed)[2])
+            for receipt, (deadline, body) in list(self.in_flight.items()):
+                if deadline <= now:
+                    # Not deleted within the visibility timeout: make it visible again
+                    del self.in_flight[receipt]
+                    self.ready.append(body)
+            if not self.ready:
+                return None
+            receipt = uuid.uuid4().hex
+            body = self.ready.popleft()
+            self.in_flight[receipt] = (now + self.visibility_timeout, body)
+            return receipt, body
+
+    def delete(self, receipt):
+        with self.lock:
+            self.in_flight.pop(receipt, None)
+
+    def pending(self):
+        with self.lock:
+            return len(self.ready) + len(self.delayed) + len(self.in_flight)
+
+class FileQueue:
+    """
+    Directory-backed fan-out queue for local runs; messages survive restarts and
+    can be shared by several worker processes. Claims are atomic renames.
+    Times live in file names rather than mtimes, so a claim and its deadline
+    are set by one rename: ready files are named <visible at ns>-<id>.json
+    and in-flight files <deadline ns>-<ready name>.
+    """
+
+    def __init__(self, path, visibility_timeout=30):
+        self.visibility_timeout = visibility_timeout
+        self.ready_dir = os.path.join(path, 'ready')
+        self.in_flight_dir = os.path.join(path, 'in_flight')
+        os.makedirs(self.ready_dir, exist_ok=True)
+        os.makedirs(self.in_flight_dir, exist_ok=True)
+
+    def send(self, bodies, delay_seconds=0):
+        visible_at = time.time_ns() + int(delay_seconds * 1e9)
+        for body in bodies:
+            name = f"{visible_at}-{uuid.uuid4().hex}.json"
+            tmp_path = os.path.join(self.ready_dir, f".{name}.tmp")
+            with open(tmp_path, 'w') as f:
+                f.write(body)
+            os.replace(tmp_path, os.path.join(self.ready_dir, name))
+
+    def _release_expired(self):
+        now = time.time_ns()
+        for receipt in os.listdir(self.in_flight_dir):
+            deadline, name = receipt.split('-', 1)
+            if int(deadline) <= now:
+                try:
+                    os.rename(os.path.join(self.in_flight_dir, receipt), os.path.join(self.ready_dir, name))
+                except FileNotFoundError:
+                    # Deleted or released by another worker
+                    pass
+
+    def receive(self):
+        """
+        Claim the next visible message as (receipt, body), or None if there is none
+        """
+        self._release_expired()
+        now = time.time_ns()
+        for name in sorted(n for n in os.listdir(self.ready_dir) if not n.startswith('.')):
+            if int(name.split('-', 1)[0]) > now:
+                # Delayed; later names become visible later still
+                break
+            receipt = f"{now + int(self.visibility_timeout * 1e9)}-{name}"
+            path = os.path.join(self.in_flight_dir, receipt)
+            try:
+                os.rename(os.path.join(self.ready_dir, name), path)
+                with open(path, 'r') as f:
+                    return receipt, f.read()
+            except FileNotFoundError:
+                # Claimed by another worker, or released again after a very short timeout
+                continue
+        return None
+
+    def delete(self, receipt):
+        try:
+            os.remove(os.path.join(self.in_flight_dir, receipt))
+        except FileNotFoundError:
+            pass
+
+    def pending(self):
+        return len(os.listdir(self.ready_dir)) + len(os.listdir(self.in_flight_dir))
+
+def enqueue_subscribers(queue, subscribers, batch_size=FANOUT_BATCH_SIZE):
+    """
+    Stream subscribers into fixed-size batches on the queue.
+    Returns (subscriber_count, batch_count).
+    """
+    subscriber_count = 0
+    batch_count = 0
+    pending = []
+    for batch in iter_batches(subscribers, batch_size):
+        pending.append(encode_batch(batch))
+        subscriber_count += len(batch)
+        batch_count += 1
+        if len(pending) >= 10:
+            queue.send(pending)
+            pending = []
+    if pending:
+        queue.send(pending)
+    return subscriber_count, batch_count
+
+def _give_up(subscribers, reason):
+    phones = ', '.join(mask_phone(subscriber['phone_number']) for subscriber in subscribers)
+    logger.error(f"Giving up on {len(subscribers)} subscribers ({reason}): {phones}")
+
+def process_batch(queue, body, messages, summary):
+    """
+    Send one queued batch. Subscribers whose send failed are re-enqueued on
+    their own so a retry never resends to the rest of the batch. Raises only
+    if nothing in the batch was attempted; once anything may have been sent,
+    errors are logged instead, since retrying the whole batch would text
+    those subscribers twice.
+    """
+    batch = json.loads(body)
+    subscribers = batch['subscribers']
+    attempt = batch.get('attempt', 1)
+    consumed = 0
+
+    def track():
+        nonlocal consumed
+        for subscriber in subscribers:
+            consumed += 1
+            yield subscriber
+
+    try:
+        failed = send_to_subscribers(track(), messages, summary)
+    except Exception as e:
+        if not consumed:
+            raise
+        # The subscriber being sent to may or may not have been texted
+        logger.error(f"Error sending batch: {str(e)}")
+        _give_up(subscribers[consumed - 1:consumed], 'send state unknown')
+        failed = subscribers[consumed:]
+    if not failed:
+        return
+
+    if attempt >= FANOUT_MAX_ATTEMPTS:
+        _give_up(failed, f"{attempt} attempts")
+        return
+
+    try:
+        queue.send([encode_batch(failed, attempt + 1)], delay_seconds=FANOUT_RETRY_DELAY_SECONDS)
+    except Exception as e:
+        logger.error(f"Error re-enqueuing failed subscribers: {str(e)}")
+        _give_up(failed, 're-enqueue failed')
+        return
+    logger.info(f"Re-enqueued {len(failed)} failed subscribers (attempt {attempt + 1})")
+
+def producer_handler(event, context):
+    """
+    Scheduled entry point: enqueue all subscribers in batches for the workers
+    """
+    try:
+        if not SUBSCRIBERS_TABLE:
+            broadcast_to_topic(get_messages(MESSAGES))
+            return {
+                'statusCode': 200,
+                'body': json.dumps('Daily message sent to topic')
+            }
+
+        subscriber_count, batch_count = enqueue_subscribers(
+            SqsQueue(FANOUT_QUEUE_URL), iter_active_subscribers(iter_subscribers)
+        )
+        if not subscriber_count:
+            # No subscribers in DynamoDB, use SNS topic
+            broadcast_to_topic(get_messages(MESSAGES))
+
+        logger.info(f"Enqueued {subscriber_count} subscribers in {batch_count} batches")
+        return {
+            'statusCode': 200,
+            'body': json.dumps(f'Enqueued {subscriber_count} subscribers in {batch_count} batches')
+        }
+    except Exception as e:
+        logger.error(f"Error enqueuing subscribers: {str(e)}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps(f'Error: {str(e)}')
+        }
+
+def worker_handler(event, context):
+    """
+    SQS entry point: send each batch in the event concurrently.
+    Batches that raise before anything was sent are reported as item
+    failures and become visible again after the queue's visibility timeout.
+    """
+    messages = get_messages(MESSAGES)
+    queue = SqsQueue(FANOUT_QUEUE_URL)
+    records = event.get('Records', [])
+    summary = RunSummary('fanout-worker')
+
+    def handle(record):
+        try:
+            process_batch(queue, record['body'], messages, summary)
+            return None
+        except Exception as e:
+            logger.error(f"Error processing batch {record['messageId']}: {str(e)}")
+            return {'itemIdentifier': record['messageId']}
+
+    with ThreadPoolExecutor(max_workers=FANOUT_WORKER_THREADS) as executor:
+        failures = [failure for failure in executor.map(handle, records) if failure]
+
+    summary.emit()
+    return {'batchItemFailures': failures}
+
+def run_workers(queue, workers=FANOUT_WORKER_THREADS, poll_interval=0.5):
+    """
+    Drain a local queue with a pool of worker threads
+    """
+    messages = get_messages(MESSAGES)
+    summary = RunSummary('fanout-local')
+
+    def worker():
+        while True:
+            try:
+                claimed = queue.receive()
+            except Exception as e:
+                # A failed poll must not end this worker while batches remain
+                logger.error(f"Error receiving from fan-out queue: {str(e)}")
+                time.sleep(poll_interval)
+                continue
+            if claimed is None:
+                if not queue.pending():
+                    return
+                # Wait for in-flight or delayed messages to finish or become visible
+                time.sleep(poll_interval)
+                continue
+            receipt, body = claimed
+            try:
+                process_batch(queue, body, messages, summary)
+                queue.delete(receipt)
+            except Exception as e:
+                # Leave it in flight; it becomes visible again after the timeout
+                logger.error(f"Error processing batch {receipt}: {str(e)}")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [executor.submit(worker) for _ in range(workers)]:
+            future.result()
+
+    return summary.emit()
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the Daily Uplift SMS fan-out locally')
+    parser.add_argument('--queue-dir', help='Directory for a file-backed queue (default: in-process queue)')
+    parser.add_argument('--subscribers-file', help='JSON lines file of subscribers (default: scan SUBSCRIBERS_TABLE)')
+    parser.add_argument('--workers', type=int, default=FANOUT_WORKER_THREADS, help='Number of worker threads')
+    parser.add_argument('--batch-size', type=int, default=FANOUT_BATCH_SIZE, help='Subscribers per batch')
+    parser.add_argument('--visibility-timeout', type=int, default=30, help='Seconds before an unfinished batch is retried')
+    parser.add_argument('--skip-produce', action='store_true', help='Only drain batches already in --queue-dir')
+
+    args = parser.parse_args()
+
+    if args.queue_dir:
+        queue = FileQueue(args.queue_dir, args.visibility_timeout)
+    else:
+        queue = MemoryQueue(args.visibility_timeout)
+
+    if not args.skip_produce:
+        if args.subscribers_file:
+            with open(args.subscribers_file, 'r') as f:
+                subscribers = (json.loads(line) for line in f if line.strip())
+                subscriber_count, batch_count = enqueue_subscribers(queue, subscribers, args.batch_size)
+        elif SUBSCRIBERS_TABLE:
+            subscriber_count, batch_count = enqueue_subscribers(
+                queue, iter_active_subscribers(iter_subscribers), args.batch_size
+            )
+        else:
+            print("Error: --subscribers-file or SUBSCRIBERS_TABLE is required")
+            sys.exit(1)
+        print(f"Enqueued {subscriber_count} subscribers in {batch_count} batches")
+
+    run_workers(queue, args.workers)
+    print("Fan-out complete")
+
+if __name__ == "__main__":
+    main()
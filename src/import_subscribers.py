@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""Bulk import subscribers from a CSV or plain list of phone numbers"""
+import csv
+import json
+import os
+import sys
+import logging
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from dynamo_batch import batch_execute, batch_get
+from opt_out import get_opted_out
+from phone_numbers import DEFAULT_COUNTRY, normalize_batch, phone_key
+from run_summary import mask_phone
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Initialize clients
+sns = boto3.client('sns')
+dynamodb = boto3.resource('dynamodb')
+
+# Get environment variables
+SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')
+SUBSCRIBERS_TABLE = os.environ.get('SUBSCRIBERS_TABLE')
+
+# Subscriptions are created in chunks so memory stays bounded however large the import
+IMPORT_CHUNK_SIZE = 500
+IMPORT_THREADS = 8
+SAMPLE_SIZE = 10
+
+def read_rows(path):
+    """
+    Read (phone, category) rows from a CSV with a phone or phone_number column,
+    or from a plain file with one number per line
+    """
+    with open(path, newline='') as f:
+        first = f.readline()
+        f.seek(0)
+        if 'phone' in first.lower():
+            reader = csv.DictReader(f)
+            for row in reader:
+                row = {key.strip().lower(): (value or '').strip() for key, value in row.items() if key}
+                phone = row.get('phone_number') or row.get('phone')
+                category = row.get('preferred_category') or row.get('category') or None
+                yield phone, category
+        else:
+            for line in f:
+                if line.strip():
+                    yield line.strip(), None
+
+def existing_phones(phones):
+    """
+    Find which numbers already have a table row, 100 keys per round trip
+    """
+    items = batch_get(
+        dynamodb, SUBSCRIBERS_TABLE, [{'phone_number': phone} for phone in phones],
+        projection='phone_number'
+    )
+    return {item['phone_number'] for item in items}
+
+def _subscribe(topic_arn, phone):
+    try:
+        response = sns.subscribe(TopicArn=topic_arn, Protocol='sms', Endpoint=phone)
+        return response['SubscriptionArn']
+    except Exception as e:
+        logger.error(f"Error subscribing {mask_phone(phone)}: {str(e)}")
+        return None
+
+def import_chunk(topic_arn, chunk):
+    """
+    Subscribe a chunk of (phone, category) pairs and insert their table rows.
+    Returns (subscribed, failures).
+    """
+    with ThreadPoolExecutor(max_workers=IMPORT_THREADS) as executor:
+        arns = list(executor.map(lambda pair: _subscribe(topic_arn, pair[0]), chunk))
+
+    created_at = datetime.utcnow().isoformat()
+    statements = []
+    for (phone, category), arn in zip(chunk, arns):
+        if not arn:
+            continue
+        if category:
+            statements.append((
+                f'INSERT INTO "{SUBSCRIBERS_TABLE}" VALUE '
+                "{'phone_number': ?, 'subscription_arn': ?, 'active': ?, 'created_at': ?, 'preferred_category': ?}",
+                [{'S': phone}, {'S': arn}, {'BOOL': True}, {'S': created_at}, {'S': category}]
+            ))
+        else:
+            statements.append((
+                f'INSERT INTO "{SUBSCRIBERS_TABLE}" VALUE '
+                "{'phone_number': ?, 'subscription_arn': ?, 'active': ?, 'created_at': ?}",
+                [{'S': phone}, {'S': arn}, {'BOOL': True}, {'S': created_at}]
+            ))
+    failed = len(batch_execute(dynamodb.meta.client, statements)) if statements else 0
+    return len(statements) - failed, len(chunk) - len(statements) + failed
+
+def import_subscribers(path, topic_arn=SNS_TOPIC_ARN, default_country=DEFAULT_COUNTRY, default_category=None, dry_run=False):
+    """
+    Validate, normalize, and deduplicate every number in the file, skip opted-out
+    and existing subscribers, then subscribe the rest. Returns a report.
+    """
+    rows = list(read_rows(path))
+    batch = normalize_batch([phone for phone, _ in rows], default_country)
+
+    rejected = {}
+    samples = {}
+    for raw, status in batch.rejected:
+        rejected[status] = rejected.get(status, 0) + 1
+        status_samples = samples.setdefault(status, [])
+        if len(status_samples) < SAMPLE_SIZE:
+            status_samples.append(mask_phone(raw or ''))
+
+    opted_out = get_opted_out()
+    candidates = []
+    skipped_opted_out = 0
+    for phone, index in zip(batch.numbers, batch.indexes):
+        if phone_key(phone) in opted_out:
+            skipped_opted_out += 1
+            continue
+        candidates.append((phone, rows[index][1] or default_category))
+
+    report = {
+        'rows': len(rows),
+        'valid': len(batch.numbers),
+        'duplicates': batch.duplicates,
+        'rejected': rejected,
+        'rejected_samples': samples,
+        'countries': batch.countries,
+        'opted_out': skipped_opted_out,
+        'existing': 0,
+        'subscribed': 0,
+        'failures': 0,
+        'dry_run': dry_run
+    }
+
+    for start in range(0, len(candidates), IMPORT_CHUNK_SIZE):
+        chunk = candidates[start:start + IMPORT_CHUNK_SIZE]
+        existing = existing_phones([phone for phone, _ in chunk])
+        report['existing'] += len(existing)
+        chunk = [pair for pair in chunk if pair[0] not in existing]
+        if dry_run:
+            report['subscribed'] += len(chunk)
+            continue
+        subscribed, failures = import_chunk(topic_arn, chunk)
+        report['subscribed'] += subscribed
+        report['failures'] += failures
+
+    logger.info(json.dumps({'subscriber_import': report}))
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk import Daily Uplift SMS subscribers')
+    parser.add_argument('file', help='CSV with a phone column (and optional category), or one number per line')
+    parser.add_argument('--topic-arn', default=SNS_TOPIC_ARN, help='SNS Topic ARN')
+    parser.add_argument('--country', default=DEFAULT_COUNTRY, help='Country for numbers without a country code (e.g., IN)')
+    parser.add_argument('--category', help='Preferred category for rows that do not set one')
+    parser.add_argument('--dry-run', action='store_true', help='Validate and report without subscribing anyone')
+
+    args = parser.parse_args()
+
+    if not SUBSCRIBERS_TABLE or (not args.topic_arn and not args.dry_run):
+        print("Error: SUBSCRIBERS_TABLE and --topic-arn (or SNS_TOPIC_ARN) are required")
+        sys.exit(1)
+
+    report = import_subscribers(args.file, args.topic_arn, args.country, args.category, args.dry_run)
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if report['failures'] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,15 @@ import logging
 from datetime import datetime
 import pytz
 import boto3.dynamodb.conditions as conditions
+from message_catalog import get_messages
+from rate_limiter import SegmentRateLimiter
+from sms_encoding import analyze
+from run_summary import RunSummary, mask_phone
+from subscriber_snapshot import iter_active_subscribers
+from opt_out import OptOutUpdates, get_opted_out, is_opted_out
+from phone_numbers import DEFAULT_COUNTRY, normalize, normalize_batch, phone_key
+from subscriber_cache import get_subscriber, get_subscribers
+from message_rotation import RotationUpdates, get_cursor, rotation_category, select_message_index
 
 # Configure logging
 logger = logging.getLogger()
@@ -19,13 +28,23 @@ dynamodb = boto3.resource('dynamodb')
 SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')
 SUBSCRIBERS_TABLE = os.environ.get('SUBSCRIBERS_TABLE')
 ANALYTICS_TABLE = os.environ.get('ANALYTICS_TABLE')
+SMS_SEGMENTS_PER_SECOND = float(os.environ.get('SMS_SEGMENTS_PER_SECOND', '0'))
+
+# Most numbers one on-demand request may target. With a send rate set, the
+# cap is lowered to what the rate allows within the invocation's remaining time.
+ON_DEMAND_MAX_PHONES = 500
+# Share of the remaining time on-demand sends may take, leaving headroom for lookups and publish latency
+ON_DEMAND_TIME_SHARE = 0.8
+
+# Paces publishes by SMS segments, shared across warm invocations
+rate_limiter = SegmentRateLimiter(SMS_SEGMENTS_PER_SECOND)
 
 def get_ist_time():
     """Get current time in IST"""
     ist = pytz.timezone('Asia/Kolkata')
     return datetime.now(ist)
 
-# Message categories with their respective messages
+# Built-in message catalog, used when no external catalog source is configured
 MESSAGES = {
     "motivation": [
         "You are capable of amazing things. Keep going!",
@@ -71,46 +90,243 @@ MESSAGES = {
     ]
 }
 
+def iter_subscribers():
+    """
+    Stream all subscribers from DynamoDB, one scan page at a time
+    """
+    table = dynamodb.Table(SUBSCRIBERS_TABLE)
+    scan_kwargs = {}
+    while True:
+        response = table.scan(**scan_kwargs)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
 def get_subscribers_preferences():
     """
     Get all subscribers and their preferences from DynamoDB
     """
     try:
-        table = dynamodb.Table(SUBSCRIBERS_TABLE)
-        response = table.scan()
-        return response.get('Items', [])
+        return list(iter_subscribers())
     except Exception as e:
         logger.error(f"Error getting subscribers: {str(e)}")
         return []
 
-def record_analytics(message_id, category, subscriber_count):
+def record_analytics(message_id, category, subscriber_count, segments=1):
     """
-    Record message delivery analytics
+    Record message delivery analytics. Called from fan-out worker threads,
+    so it uses the (thread-safe) client rather than the shared resource.
     """
     try:
         if ANALYTICS_TABLE:
-            table = dynamodb.Table(ANALYTICS_TABLE)
-            table.put_item(Item={
-                'message_id': message_id,
-                'timestamp': get_ist_time().isoformat(),
-                'category': category,
-                'subscriber_count': subscriber_count
+            dynamodb.meta.client.put_item(TableName=ANALYTICS_TABLE, Item={
+                'message_id': {'S': message_id},
+                'timestamp': {'S': get_ist_time().isoformat()},
+                'category': {'S': category},
+                'subscriber_count': {'N': str(subscriber_count)},
+                'segments': {'N': str(segments)}
             })
     except Exception as e:
         logger.error(f"Error recording analytics: {str(e)}")
 
+def send_to_subscribers(subscribers, messages, summary):
+    """
+    Send each subscriber the next message in their rotation, counting results in `summary`.
+    Returns the subscribers whose send failed so the caller can retry them.
+    """
+    failed = []
+    rotation = RotationUpdates(dynamodb.meta.client, SUBSCRIBERS_TABLE)
+    opt_outs = OptOutUpdates(dynamodb.meta.client, SUBSCRIBERS_TABLE)
+    opted_out = get_opted_out()
+    try:
+        for subscriber in subscribers:
+            phone = subscriber['phone_number']
+            category = rotation_category(subscriber)
+            
+            # Skip numbers that replied STOP; SNS would reject the publish anyway
+            try:
+                key = phone_key(phone)
+            except ValueError:
+                key = None
+            if key in opted_out:
+                summary.record_skipped(phone, 'opted_out')
+                if subscriber.get('active', True) is not False:
+                    opt_outs.deactivate(phone)
+                continue
+            
+            # Fallback to random category
+            if category not in messages or not messages[category]:
+                category = random.choice(list(messages.keys()))
+            
+            # Select the next unsent message in the subscriber's rotation
+            cursor = get_cursor(subscriber, category)
+            index = select_message_index(phone, category, cursor, len(messages[category]))
+            message = messages[category][index]
+            segments = analyze(message).segments
+            
+            try:
+                # Send personalized message
+                rate_limiter.acquire(segments)
+                response = sns.publish(
+                    PhoneNumber=phone,
+                    Message=message,
+                    MessageAttributes={
+                        'SMSType': {
+                            'DataType': 'String',
+                            'StringValue': 'Transactional'
+                        }
+                    }
+                )
+            except Exception as e:
+                summary.record_failed(phone, category, e)
+                failed.append(subscriber)
+                continue
+            
+            summary.record_sent(phone, category, response['MessageId'], segments)
+            rotation.advance(phone, category, cursor)
+            
+            # Record analytics
+            record_analytics(response['MessageId'], category, 1, segments)
+    finally:
+        # Save rotation state and newly opted-out subscribers in batched passes
+        rotation.flush()
+        opt_outs.flush()
+    
+    return failed
+
+def broadcast_to_topic(messages):
+    """
+    Publish one random message to the SNS topic
+    """
+    # Select a random category and message
+    category = random.choice(list(messages.keys()))
+    message = random.choice(messages[category])
+    
+    # Publish to SNS topic
+    response = sns.publish(
+        TopicArn=SNS_TOPIC_ARN,
+        Message=message,
+        Subject='Daily Uplift',
+        MessageAttributes={
+            'SMSType': {
+                'DataType': 'String',
+                'StringValue': 'Transactional'
+            }
+        }
+    )
+    
+    logger.info(f"Message sent to topic: {response['MessageId']}")
+    
+    # Record analytics
+    record_analytics(response['MessageId'], category, 0, analyze(message).segments)  # 0 means unknown count
+
+def pick_message(messages, category):
+    """
+    Select a random message from a category, falling back to motivation if
+    the category is not found, or any category if the catalog no longer has motivation
+    """
+    if category not in messages:
+        category = 'motivation' if 'motivation' in messages else random.choice(list(messages.keys()))
+    return random.choice(messages[category])
+
+def on_demand_limit(messages, context):
+    """
+    Most numbers an on-demand request can reach before the function times
+    out, assuming every message is as long as the longest in the catalog
+    """
+    if SMS_SEGMENTS_PER_SECOND <= 0 or context is None:
+        return ON_DEMAND_MAX_PHONES
+    segments = max(analyze(message).segments for category in messages.values() for message in category)
+    seconds = context.get_remaining_time_in_millis() / 1000 * ON_DEMAND_TIME_SHARE
+    return max(1, min(ON_DEMAND_MAX_PHONES, int(seconds * SMS_SEGMENTS_PER_SECOND / segments)))
+
+def send_on_demand(body, messages, context=None):
+    """
+    Send to a list of numbers from a direct API call. Preferences are read
+    from the subscriber cache, with misses fetched 100 numbers per round trip.
+    Lists longer than the send rate allows in one invocation are refused
+    rather than cut short by the timeout.
+    """
+    batch = normalize_batch(body.get('phones') or [], body.get('country') or DEFAULT_COUNTRY)
+    limit = on_demand_limit(messages, context)
+    if len(batch.numbers) > limit:
+        return {
+            'statusCode': 400,
+            'body': json.dumps(f'At most {limit} phones per request at the current send rate')
+        }
+    
+    if SUBSCRIBERS_TABLE:
+        subscribers = get_subscribers(batch.numbers)
+    else:
+        subscribers = {phone: {'phone_number': phone} for phone in batch.numbers}
+    opted_out = get_opted_out()
+    
+    summary = RunSummary('on_demand')
+    for raw, status in batch.rejected:
+        summary.record_skipped(str(raw), status)
+    for phone in batch.numbers:
+        subscriber = subscribers.get(phone)
+        if subscriber is None:
+            summary.record_skipped(phone, 'not_found')
+            continue
+        if phone_key(phone) in opted_out:
+            summary.record_skipped(phone, 'opted_out')
+            continue
+        
+        # Override category if specified in request
+        category = body.get('category') or subscriber.get('preferred_category', 'motivation')
+        message = pick_message(messages, category)
+        segments = analyze(message).segments
+        try:
+            rate_limiter.acquire(segments)
+            response = sns.publish(
+                PhoneNumber=phone,
+                Message=message,
+                MessageAttributes={
+                    'SMSType': {
+                        'DataType': 'String',
+                        'StringValue': 'Transactional'
+                    }
+                }
+            )
+        except Exception as e:
+            summary.record_failed(phone, category, e)
+            continue
+        summary.record_sent(phone, category, response['MessageId'], segments)
+    
+    return {
+        'statusCode': 200,
+        'body': json.dumps(summary.emit())
+    }
+
 def lambda_handler(event, context):
     try:
+        # Load the message catalog (cached per container)
+        messages = get_messages(MESSAGES)
+        
         # Check if this is a direct API call with specific parameters
         if event.get('httpMethod') == 'POST' and 'body' in event:
             body = json.loads(event['body'])
-            phone = body.get('phone')
+            
+            # Several recipients: one batched lookup instead of a read per number
+            if 'phones' in body:
+                return send_on_demand(body, messages, context)
+            
             category = body.get('category', 'motivation')
             
-            # Get a single subscriber's preferences
+            # Canonicalize to E.164 so differently formatted input finds the same subscriber
+            try:
+                phone = normalize(body.get('phone'), body.get('country') or DEFAULT_COUNTRY)
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'body': json.dumps(str(e))
+                }
+            
+            # Get a single subscriber's preferences (cached per container)
             if SUBSCRIBERS_TABLE:
-                table = dynamodb.Table(SUBSCRIBERS_TABLE)
-                subscriber = table.get_item(Key={'phone_number': phone}).get('Item')
+                subscriber = get_subscriber(phone)
                 if not subscriber:
                     return {
                         'statusCode': 404,
@@ -124,14 +340,18 @@ def lambda_handler(event, context):
                     # Use subscriber's preferred category if available
                     category = subscriber.get('preferred_category', 'motivation')
             
+            # SNS rejects SMS to numbers that replied STOP
+            if is_opted_out(phone):
+                return {
+                    'statusCode': 409,
+                    'body': json.dumps('Subscriber has opted out of SMS')
+                }
+            
             # Select a random message from the specified category
-            if category in MESSAGES:
-                message = random.choice(MESSAGES[category])
-            else:
-                # Fallback to motivation if category not found
-                message = random.choice(MESSAGES['motivation'])
+            message = pick_message(messages, category)
             
             # Send to a specific subscriber
+            rate_limiter.acquire(analyze(message).segments)
             response = sns.publish(
                 PhoneNumber=phone,
                 Message=message,
@@ -143,68 +363,26 @@ def lambda_handler(event, context):
                 }
             )
             
-            logger.info(f"Message sent to {phone}: {response['MessageId']}")
+            logger.info(f"Message sent to {mask_phone(phone)}: {response['MessageId']}")
             return {
                 'statusCode': 200,
                 'body': json.dumps('Message sent successfully!')
             }
         
         # Regular scheduled execution - send to all subscribers
-        subscribers = get_subscribers_preferences() if SUBSCRIBERS_TABLE else []
+        # Read from the subscriber snapshot, falling back to a full scan when it is stale.
+        # A failed scan raises rather than looking like an empty table, so it is
+        # never mistaken for "no subscribers" and broadcast to the whole topic.
+        subscribers = list(iter_active_subscribers(iter_subscribers)) if SUBSCRIBERS_TABLE else []
         
         if subscribers:
             # Send personalized messages based on preferences
-            for subscriber in subscribers:
-                phone = subscriber['phone_number']
-                category = subscriber.get('preferred_category', 'motivation')
-                
-                # Select message based on preferred category
-                if category in MESSAGES and MESSAGES[category]:
-                    message = random.choice(MESSAGES[category])
-                else:
-                    # Fallback to random category
-                    random_category = random.choice(list(MESSAGES.keys()))
-                    message = random.choice(MESSAGES[random_category])
-                    category = random_category
-                
-                # Send personalized message
-                response = sns.publish(
-                    PhoneNumber=phone,
-                    Message=message,
-                    MessageAttributes={
-                        'SMSType': {
-                            'DataType': 'String',
-                            'StringValue': 'Transactional'
-                        }
-                    }
-                )
-                logger.info(f"Personalized message sent to {phone}: {response['MessageId']}")
-                
-                # Record analytics
-                record_analytics(response['MessageId'], category, 1)
+            summary = RunSummary('scheduled')
+            send_to_subscribers(subscribers, messages, summary)
+            summary.emit()
         else:
             # No subscribers in DynamoDB or table not configured, use SNS topic
-            # Select a random category and message
-            category = random.choice(list(MESSAGES.keys()))
-            message = random.choice(MESSAGES[category])
-            
-            # Publish to SNS topic
-            response = sns.publish(
-                TopicArn=SNS_TOPIC_ARN,
-                Message=message,
-                Subject='Daily Uplift',
-                MessageAttributes={
-                    'SMSType': {
-                        'DataType': 'String',
-                        'StringValue': 'Transactional'
-                    }
-                }
-            )
-            
-            logger.info(f"Message sent to topic: {response['MessageId']}")
-            
-            # Record analytics
-            record_analytics(response['MessageId'], category, 0)  # 0 means unknown count
+            broadcast_to_topic(messages)
         
         return {
             'statusCode': 200,
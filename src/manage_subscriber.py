@@ -3,6 +3,7 @@ import boto3
 import argparse
 import sys
 import json
+from phone_numbers import DEFAULT_COUNTRY, normalize
 
 def subscribe_phone_number(topic_arn, phone_number, preferred_category=None):
     """
@@ -146,14 +147,17 @@ def main():
                         help='Action to perform')
     parser.add_argument('--topic-arn', help='SNS Topic ARN (required for subscribe/unsubscribe)')
     parser.add_argument('--phone', required=True, help='Phone number with country code (e.g., +12345678901)')
+    parser.add_argument('--country', default=DEFAULT_COUNTRY, help='Country for numbers without a country code (e.g., IN)')
     parser.add_argument('--category', choices=['motivation', 'mental_health', 'mindfulness'], 
                         help='Preferred message category')
     
     args = parser.parse_args()
     
-    # Validate phone number format
-    if not args.phone.startswith('+'):
-        print("Error: Phone number must include country code and start with '+' (e.g., +12345678901)")
+    # Validate and canonicalize the phone number
+    try:
+        args.phone = normalize(args.phone, args.country)
+    except ValueError as e:
+        print(f"Error: {str(e)}. Include the country code (e.g., +12345678901) or pass --country")
         sys.exit(1)
     
     if args.action == 'subscribe':
@@ -0,0 +1,141 @@
+"""Hot-reloadable message catalog for Daily Uplift SMS"""
+import os
+import time
+import logging
+import boto3
+from sms_encoding import analyze
+
+# Configure logging
+logger = logging.getLogger()
+
+# Initialize clients
+s3 = boto3.client('s3')
+
+# Get environment variables
+MESSAGES_BUCKET = os.environ.get('MESSAGES_BUCKET')
+MESSAGES_PREFIX = os.environ.get('MESSAGES_PREFIX', 'messages/')
+MESSAGES_DIR = os.environ.get('MESSAGES_DIR')
+MESSAGES_REFRESH_SECONDS = int(os.environ.get('MESSAGES_REFRESH_SECONDS', '300'))
+
+# Per-container cache, survives across warm invocations
+_cache = {
+    'messages': None,
+    'sources': {},
+    'version': 0,
+    'checked_at': None
+}
+
+def parse_messages(text):
+    """
+    Parse a category file: one message per non-empty line
+    """
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+def _list_s3_sources():
+    """
+    List category files in S3 as {category: (key, etag)}
+    """
+    sources = {}
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=MESSAGES_BUCKET, Prefix=MESSAGES_PREFIX):
+        for obj in page.get('Contents', []):
+            key = obj['Key']
+            if key.endswith('.txt'):
+                category = os.path.basename(key)[:-len('.txt')]
+                sources[category] = (key, obj['ETag'])
+    return sources
+
+def _list_local_sources():
+    """
+    List category files in the local directory as {category: (path, mtime)}
+    """
+    sources = {}
+    with os.scandir(MESSAGES_DIR) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith('.txt'):
+                category = entry.name[:-len('.txt')]
+                sources[category] = (entry.path, entry.stat().st_mtime_ns)
+    return sources
+
+def _read_s3(key):
+    """
+    Read a category file from S3
+    """
+    response = s3.get_object(Bucket=MESSAGES_BUCKET, Key=key)
+    return response['Body'].read().decode('utf-8')
+
+def _read_local(path):
+    """
+    Read a category file from the local directory
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+def _check_encoding(category, lines):
+    """
+    Analyze encoding and segments for every message, warming the analysis cache
+    and flagging messages that fall back to UCS-2
+    """
+    for line in lines:
+        info = analyze(line)
+        if info.encoding != 'GSM-7':
+            logger.warning(
+                f"Message in {category} uses {info.encoding} ({info.segments} segments) "
+                f"due to {''.join(info.non_gsm)!r}: {line}"
+            )
+
+def _refresh():
+    """
+    Revalidate the cached catalog against its source, reloading only changed categories
+    """
+    if MESSAGES_BUCKET:
+        sources, read = _list_s3_sources(), _read_s3
+    else:
+        sources, read = _list_local_sources(), _read_local
+
+    cached = _cache['messages'] or {}
+    if cached and sources == _cache['sources']:
+        return
+
+    messages = {}
+    for category, (location, version) in sources.items():
+        if category in cached and _cache['sources'].get(category) == (location, version):
+            messages[category] = cached[category]
+        else:
+            lines = parse_messages(read(location))
+            if lines:
+                messages[category] = lines
+                _check_encoding(category, lines)
+
+    if not messages:
+        raise ValueError('Message catalog source has no messages')
+
+    _cache['messages'] = messages
+    _cache['sources'] = sources
+    _cache['version'] += 1
+    logger.info(f"Loaded message catalog version {_cache['version']}: {sorted(messages)}")
+
+def get_messages(default=None):
+    """
+    Get the message catalog, revalidating at most once per refresh interval.
+    Falls back to the last good catalog, then to `default`, if the source fails.
+    """
+    if not MESSAGES_BUCKET and not MESSAGES_DIR:
+        return default
+
+    now = time.monotonic()
+    checked_at = _cache['checked_at']
+    if checked_at is None or now - checked_at >= MESSAGES_REFRESH_SECONDS:
+        _cache['checked_at'] = now
+        try:
+            _refresh()
+        except Exception as e:
+            logger.error(f"Error refreshing message catalog: {str(e)}")
+
+    return _cache['messages'] or default
+
+def get_catalog_version():
+    """
+    Get the version number of the cached catalog (0 until first load)
+    """
+    return _cache['version']
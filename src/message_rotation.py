@@ -0,0 +1,102 @@
+"""No-repeat message rotation for Daily Uplift SMS subscribers"""
+import hashlib
+import logging
+from math import gcd
+from dynamo_batch import batch_execute
+
+# Configure logging
+logger = logging.getLogger()
+
+# Each subscriber stores one integer cursor per category, e.g. rotation_motivation = 12
+ROTATION_ATTRIBUTE_PREFIX = 'rotation_'
+
+# Category for subscribers who never chose one
+DEFAULT_CATEGORY = 'motivation'
+
+def rotation_category(subscriber):
+    """
+    Get the category whose rotation a subscriber's scheduled sends advance
+    """
+    return subscriber.get('preferred_category') or DEFAULT_CATEGORY
+
+def rotation_attribute(category):
+    """
+    Get the subscriber attribute holding the rotation cursor for a category
+    """
+    return f"{ROTATION_ATTRIBUTE_PREFIX}{category}"
+
+def get_cursor(subscriber, category):
+    """
+    Get a subscriber's rotation cursor for a category (0 if never sent)
+    """
+    return int(subscriber.get(rotation_attribute(category), 0))
+
+def _permute(phone, category, cycle, size, position):
+    """
+    Map a position to a message index with a seeded affine permutation.
+    Each (phone, category, cycle) gets its own ordering of range(size).
+    """
+    seed = hashlib.blake2b(f"{phone}:{category}:{cycle}".encode('utf-8'), digest_size=8).digest()
+    h = int.from_bytes(seed, 'big')
+    multiplier = 1 + h % (size - 1)
+    while gcd(multiplier, size) != 1:
+        multiplier = multiplier % (size - 1) + 1
+    offset = (h >> 32) % size
+    return (multiplier * position + offset) % size
+
+def select_message_index(phone, category, cursor, size):
+    """
+    Select the message index for a subscriber's next send in O(1).
+    Every message in the category is sent once before any repeats, and a
+    new cycle never starts with the message that ended the previous one.
+    Changing the catalog size reshuffles the remaining order.
+    """
+    if size <= 1:
+        return 0
+    if size == 2:
+        # Only strict alternation avoids back-to-back repeats
+        return (cursor + _permute(phone, category, 0, size, 0)) % size
+
+    cycle, position = divmod(cursor, size)
+    if cycle > 0 and position < 2:
+        previous = _permute(phone, category, cycle - 1, size, size - 1)
+        if _permute(phone, category, cycle, size, 0) == previous:
+            # Swap the first two positions so the boundary never repeats
+            position = 1 - position
+
+    return _permute(phone, category, cycle, size, position)
+
+class RotationUpdates:
+    """
+    Collects advanced cursors during a run and writes them back in batches
+    """
+
+    def __init__(self, client, table_name):
+        self.client = client
+        self.table_name = table_name
+        self.updates = []
+
+    def advance(self, phone, category, cursor):
+        """
+        Record that a subscriber's cursor moved past `cursor`
+        """
+        self.updates.append((phone, rotation_attribute(category), cursor + 1))
+
+    def flush(self):
+        """
+        Write all recorded cursors with batched PartiQL updates
+        """
+        if not self.updates:
+            return []
+
+        statements = [
+            (
+                f'UPDATE "{self.table_name}" SET "{attribute}" = ? WHERE "phone_number" = ?',
+                [{'N': str(cursor)}, {'S': phone}]
+            )
+            for phone, attribute, cursor in self.updates
+        ]
+        self.updates = []
+        failed = batch_execute(self.client, statements)
+        logger.info(f"Saved rotation state for {len(statements) - len(failed)} subscribers")
+        return failed
@@ -0,0 +1,96 @@
+"""Cached SMS opt-out list for Daily Uplift SMS"""
+import os
+import time
+import logging
+import boto3
+from dynamo_batch import batch_execute
+from phone_numbers import phone_key
+
+# Configure logging
+logger = logging.getLogger()
+
+# Initialize clients
+sns = boto3.client('sns')
+
+# Get environment variables
+OPT_OUT_REFRESH_SECONDS = int(os.environ.get('OPT_OUT_REFRESH_SECONDS', '900'))
+
+# Per-container cache of opted-out numbers as integer phone keys
+_cache = {
+    'keys': frozenset(),
+    'checked_at': None
+}
+
+def load_opted_out():
+    """
+    Fetch every opted-out number from SNS, following pagination
+    """
+    keys = set()
+    kwargs = {}
+    while True:
+        response = sns.list_phone_numbers_opted_out(**kwargs)
+        for phone in response.get('phoneNumbers', []):
+            if not phone.startswith('+'):
+                phone = f"+{phone}"
+            try:
+                keys.add(phone_key(phone))
+            except ValueError:
+                continue
+        if not response.get('nextToken'):
+            break
+        kwargs['nextToken'] = response['nextToken']
+    return frozenset(keys)
+
+def get_opted_out():
+    """
+    Get the opted-out keys, refreshing at most once per refresh interval.
+    Keeps the last good list if SNS cannot be reached.
+    """
+    now = time.monotonic()
+    checked_at = _cache['checked_at']
+    if checked_at is None or now - checked_at >= OPT_OUT_REFRESH_SECONDS:
+        _cache['checked_at'] = now
+        try:
+            _cache['keys'] = load_opted_out()
+            logger.info(f"Loaded {len(_cache['keys'])} opted-out numbers")
+        except Exception as e:
+            logger.error(f"Error loading opted-out numbers: {str(e)}")
+    return _cache['keys']
+
+def is_opted_out(phone):
+    """
+    Check whether SNS will reject SMS to this number because it replied STOP
+    """
+    try:
+        return phone_key(phone) in get_opted_out()
+    except ValueError:
+        return False
+
+class OptOutUpdates:
+    """
+    Collects subscribers found opted out during a run and marks them inactive in batches
+    """
+
+    def __init__(self, client, table_name):
+        self.client = client
+        self.table_name = table_name
+        self.phones = []
+
+    def deactivate(self, phone):
+        self.phones.append(phone)
+
+    def flush(self):
+        if not self.phones or not self.table_name:
+            return []
+
+        statements = [
+            (
+                f'UPDATE "{self.table_name}" SET "active" = ? WHERE "phone_number" = ?',
+                [{'BOOL': False}, {'S': phone}]
+            )
+            for phone in self.phones
+        ]
+        self.phones = []
+        failed = batch_execute(self.client, statements)
+        logger.info(f"Marked {len(statements) - len(failed)} opted-out subscribers inactive")
+        return failed
@@ -0,0 +1,204 @@
+"""Phone number validation, normalization, and compact keys for Daily Uplift SMS"""
+import os
+from collections import namedtuple
+
+# Get environment variables
+DEFAULT_COUNTRY = os.environ.get('DEFAULT_COUNTRY') or None
+
+# E.164 numbers have at most 15 digits, so every number fits in an unsigned 64-bit key
+MAX_E164_DIGITS = 15
+MIN_E164_DIGITS = 8
+
+# Classification results
+VALID = 'valid'
+UNKNOWN_COUNTRY = 'unknown_country'    # Well-formed E.164 with a calling code not in the table
+INVALID_LENGTH = 'invalid_length'      # Wrong number of digits for the country
+MISSING_COUNTRY = 'missing_country'    # National format with no default country to apply
+MALFORMED = 'malformed'                # Letters, extensions, or no digits at all
+
+# Statuses that are safe to send to
+SENDABLE = (VALID, UNKNOWN_COUNTRY)
+
+Country = namedtuple('Country', ['iso', 'code', 'min_length', 'max_length', 'trunk'])
+
+# Calling code, national number length range, and the trunk prefix dialled
+# before national numbers (None where the leading 0 is part of the number).
+# +1 is shared by the whole North American Numbering Plan and classified as US.
+COUNTRIES = [
+    Country('US', '1', 10, 10, '1'),
+    Country('RU', '7', 10, 10, '8'),
+    Country('EG', '20', 10, 10, '0'),
+    Country('ZA', '27', 9, 9, '0'),
+    Country('NL', '31', 9, 9, '0'),
+    Country('BE', '32', 8, 9, '0'),
+    Country('FR', '33', 9, 9, '0'),
+    Country('ES', '34', 9, 9, None),
+    Country('IT', '39', 6, 11, None),
+    Country('CH', '41', 9, 9, '0'),
+    Country('AT', '43', 4, 13, '0'),
+    Country('GB', '44', 9, 10, '0'),
+    Country('DK', '45', 8, 8, None),
+    Country('SE', '46', 7, 9, '0'),
+    Country('NO', '47', 8, 8, None),
+    Country('PL', '48', 9, 9, None),
+    Country('DE', '49', 6, 13, '0'),
+    Country('MX', '52', 10, 10, None),
+    Country('AR', '54', 10, 11, '0'),
+    Country('BR', '55', 10, 11, '0'),
+    Country('MY', '60', 9, 10, '0'),
+    Country('AU', '61', 9, 9, '0'),
+    Country('ID', '62', 9, 12, '0'),
+    Country('PH', '63', 10, 10, '0'),
+    Country('NZ', '64', 8, 10, '0'),
+    Country('SG', '65', 8, 8, None),
+    Country('TH', '66', 9, 9, '0'),
+    Country('JP', '81', 9, 10, '0'),
+    Country('KR', '82', 9, 10, '0'),
+    Country('VN', '84', 9, 10, '0'),
+    Country('CN', '86', 11, 11, '0'),
+    Country('TR', '90', 10, 10, '0'),
+    Country('IN', '91', 10, 10, '0'),
+    Country('PK', '92', 10, 10, '0'),
+    Country('LK', '94', 9, 9, '0'),
+    Country('NG', '234', 8, 10, '0'),
+    Country('KE', '254', 9, 9, '0'),
+    Country('PT', '351', 9, 9, None),
+    Country('IE', '353', 7, 9, '0'),
+    Country('HK', '852', 8, 8, None),
+    Country('BD', '880', 10, 10, '0'),
+    Country('AE', '971', 8, 9, '0'),
+    Country('SA', '966', 9, 9, '0'),
+    Country('NP', '977', 8, 10, None),
+]
+
+# Precompiled lookups. Calling codes are prefix-free, so at most one of the
+# 1-, 2-, and 3-digit prefixes of a number can match.
+_BY_CODE = {country.code: country for country in COUNTRIES}
+_BY_ISO = {country.iso: country for country in COUNTRIES}
+_MAX_CODE_LENGTH = max(len(code) for code in _BY_CODE)
+
+# Formatting characters people type between digits
+_SEPARATORS = str.maketrans('', '', ' \t-.()/\u00a0')
+
+PhoneInfo = namedtuple('PhoneInfo', ['e164', 'key', 'country', 'status'])
+
+def phone_key(phone):
+    """
+    Convert an E.164 number (e.g. +12345678901) to a compact integer key
+    """
+    digits = phone[1:] if phone.startswith('+') else ''
+    if not digits.isdigit() or not digits.isascii() or len(digits) > MAX_E164_DIGITS or digits[0] == '0':
+        raise ValueError(f"Not an E.164 phone number: {phone!r}")
+    return int(digits)
+
+def phone_from_key(key):
+    """
+    Convert an integer key back to an E.164 number
+    """
+    return f"+{key}"
+
+def country_for(digits):
+    """
+    Find the country whose calling code prefixes an international digit string
+    """
+    for length in range(1, _MAX_CODE_LENGTH + 1):
+        country = _BY_CODE.get(digits[:length])
+        if country:
+            return country
+    return None
+
+def _rejected(status, country=None):
+    return PhoneInfo(None, None, country.iso if country else None, status)
+
+def _check(digits):
+    """
+    Classify an international digit string (country code first)
+    """
+    if digits[0] == '0':
+        return _rejected(MALFORMED)
+    if len(digits) > MAX_E164_DIGITS:
+        return _rejected(INVALID_LENGTH)
+    country = country_for(digits)
+    if country is None:
+        if len(digits) < MIN_E164_DIGITS:
+            return _rejected(INVALID_LENGTH)
+        return PhoneInfo(f"+{digits}", int(digits), None, UNKNOWN_COUNTRY)
+
+    national = digits[len(country.code):]
+    if country.trunk and national.startswith(country.trunk) and len(national) > country.max_length:
+        # "+44 (0)20 ..." style: drop the trunk prefix written after the calling code
+        national = national[len(country.trunk):]
+    if not country.min_length <= len(national) <= country.max_length:
+        return _rejected(INVALID_LENGTH, country)
+    digits = country.code + national
+    return PhoneInfo(f"+{digits}", int(digits), country.iso, VALID)
+
+def classify(raw, default_country=DEFAULT_COUNTRY):
+    """
+    Parse a number as typed and classify it. International numbers may start
+    with + or 00; national numbers need a default country (ISO code such as
+    'IN'), whose trunk prefix is dropped before the calling code is added.
+    Anything but a string (e.g. a JSON number, which has lost any leading
+    zeros) is malformed.
+    """
+    if not raw or not isinstance(raw, str):
+        return _rejected(MALFORMED)
+    text = raw.translate(_SEPARATORS)
+    if text.startswith('+'):
+        digits = text[1:]
+    elif text.startswith('00'):
+        digits = text[2:]
+    else:
+        digits = None
+    if digits is not None:
+        if not digits.isdigit() or not digits.isascii():
+            return _rejected(MALFORMED)
+        return _check(digits)
+
+    if not text.isdigit() or not text.isascii():
+        return _rejected(MALFORMED)
+    country = _BY_ISO.get(default_country.upper()) if default_country else None
+    if country is None:
+        return _rejected(MISSING_COUNTRY)
+    if country.trunk and text.startswith(country.trunk) and len(text) > country.min_length:
+        text = text[len(country.trunk):]
+    return _check(country.code + text)
+
+def normalize(raw, default_country=DEFAULT_COUNTRY):
+    """
+    Canonicalize a number to E.164, raising ValueError if it cannot be sent to
+    """
+    info = classify(raw, default_country)
+    if info.status not in SENDABLE:
+        raise ValueError(f"Invalid phone number {raw!r}: {info.status}")
+    return info.e164
+
+BatchResult = namedtuple('BatchResult', ['numbers', 'indexes', 'countries', 'duplicates', 'rejected'])
+
+def normalize_batch(raws, default_country=DEFAULT_COUNTRY):
+    """
+    Normalize many numbers at once, dropping duplicates by integer key.
+    Returns the unique E.164 numbers in input order with their input
+    positions, counts per country, the duplicate count, and (raw, status)
+    pairs for rejected input.
+    """
+    seen = set()
+    numbers = []
+    indexes = []
+    countries = {}
+    rejected = []
+    duplicates = 0
+    for index, raw in enumerate(raws):
+        info = classify(raw, default_country)
+        if info.status not in SENDABLE:
+            rejected.append((raw, info.status))
+            continue
+        if info.key in seen:
+            duplicates += 1
+            continue
+        seen.add(info.key)
+        numbers.append(info.e164)
+        indexes.append(index)
+        country = info.country or 'unknown'
+        countries[country] = countries.get(country, 0) + 1
+    return BatchResult(numbers, indexes, countries, duplicates, rejected)
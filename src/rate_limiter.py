@@ -0,0 +1,32 @@
+"""Segment-based send rate limiting for Daily Uplift SMS"""
+import threading
+import time
+
+class SegmentRateLimiter:
+    """
+    Token bucket that paces sends by SMS segments rather than messages.
+    A rate of 0 or less disables limiting.
+    """
+
+    def __init__(self, segments_per_second):
+        self.rate = float(segments_per_second)
+        self.tokens = self.rate
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, segments=1):
+        """
+        Block until `segments` segments may be sent
+        """
+        if self.rate <= 0:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= segments
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if wait > 0:
+            time.sleep(wait)
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""Reconcile SNS topic subscriptions with the subscribers table"""
+import json
+import os
+import sys
+import zlib
+import struct
+import logging
+import argparse
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from dynamo_batch import batch_execute, batch_get
+from phone_numbers import phone_key, phone_from_key
+from run_summary import mask_phone
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Initialize clients
+sns = boto3.client('sns')
+dynamodb = boto3.resource('dynamodb')
+
+# Get environment variables
+SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')
+SUBSCRIBERS_TABLE = os.environ.get('SUBSCRIBERS_TABLE')
+RECONCILE_SCAN_SEGMENTS = int(os.environ.get('RECONCILE_SCAN_SEGMENTS', '4'))
+RECONCILE_REPAIR = os.environ.get('RECONCILE_REPAIR', '').lower() in ('1', 'true', 'yes')
+
+# Repairs are applied in chunks so memory stays bounded however large the drift
+REPAIR_CHUNK_SIZE = 500
+REPAIR_THREADS = 8
+SAMPLE_SIZE = 10
+
+# Kinds of drift
+ORPHAN_SUBSCRIPTION = 'orphan_subscription'        # SNS subscription with no table row
+INACTIVE_SUBSCRIPTION = 'inactive_subscription'    # SNS subscription for a row marked inactive
+DUPLICATE_SUBSCRIPTION = 'duplicate_subscription'  # More than one SNS subscription for a phone
+STALE_ARN = 'stale_arn'                            # Row stores a different ARN than SNS has
+MISSING_SUBSCRIPTION = 'missing_subscription'      # Active row with no SNS subscription
+INVALID_PHONE = 'invalid_phone'                    # Phone number that is not E.164
+
+def arn_hash(arn):
+    """
+    Compact 32-bit fingerprint of a subscription ARN (0 means no ARN)
+    """
+    if not arn:
+        return 0
+    return zlib.crc32(arn.encode('utf-8')) or 1
+
+# Packed table row: phone key, ARN fingerprint, active. Big-endian so rows sort by key as bytes.
+ROW = struct.Struct('>QIB')
+
+class TableIndex:
+    """
+    Sorted, array-backed index of table rows: 14 bytes per subscriber
+    """
+
+    def __init__(self, rows):
+        rows.sort()
+        self.keys = array('Q')
+        self.arn_hashes = array('I')
+        self.active = bytearray()
+        for key, fingerprint, active in (ROW.unpack(row) for row in rows):
+            self.keys.append(key)
+            self.arn_hashes.append(fingerprint)
+            self.active.append(active)
+        self.seen = bytearray(len(self.keys))
+
+    def find(self, key):
+        index = bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            return index
+        return None
+
+def _scan_segment(segment, total_segments):
+    """
+    Scan one parallel segment of the table, returning (rows, invalid phones)
+    """
+    table = dynamodb.Table(SUBSCRIBERS_TABLE)
+    scan_kwargs = {
+        'Segment': segment,
+        'TotalSegments': total_segments,
+        'ProjectionExpression': 'phone_number, subscription_arn, active'
+    }
+    rows = []
+    invalid = []
+    while True:
+        response = table.scan(**scan_kwargs)
+        for item in response.get('Items', []):
+            try:
+                key = phone_key(item['phone_number'])
+            except ValueError:
+                invalid.append(item['phone_number'])
+                continue
+            active = item.get('active', True) is not False
+            rows.append(ROW.pack(key, arn_hash(item.get('subscription_arn')), 1 if active else 0))
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return rows, invalid
+
+def load_table_index(total_segments=RECONCILE_SCAN_SEGMENTS):
+    """
+    Scan the table in parallel segments into a compact sorted index
+    """
+    rows = []
+    invalid = []
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        for segment_rows, segment_invalid in executor.map(
+            lambda segment: _scan_segment(segment, total_segments), range(total_segments)
+        ):
+            rows.extend(segment_rows)
+            invalid.extend(segment_invalid)
+    return TableIndex(rows), invalid
+
+def iter_topic_subscriptions(topic_arn):
+    """
+    Stream (phone, subscription ARN) pairs for SMS subscriptions on the topic
+    """
+    paginator = sns.get_paginator('list_subscriptions_by_topic')
+    for page in paginator.paginate(TopicArn=topic_arn):
+        for sub in page['Subscriptions']:
+            if sub.get('Protocol') == 'sms' and sub['SubscriptionArn'].startswith('arn:'):
+                yield sub['Endpoint'], sub['SubscriptionArn']
+
+class Repairer:
+    """
+    Buffers repairs and applies them in bulk: SNS calls on a thread pool,
+    table updates as batched PartiQL statements
+    """
+
+    def __init__(self, topic_arn, table_name, adopt_orphans=False):
+        self.topic_arn = topic_arn
+        self.table_name = table_name
+        self.adopt_orphans = adopt_orphans
+        # Drift found against the index, re-checked against the table on flush
+        self.orphans = []
+        self.inactive = []
+        self.missing = []
+        self.stale = []
+        # Repairs to apply
+        self.unsubscribes = []
+        self.subscribes = []
+        self.arn_updates = []
+        self.adoptions = []
+        self.failures = 0
+        self.rechecked = 0
+
+    def add(self, kind, phone, arn, fingerprint=0):
+        """
+        Buffer a repair. `fingerprint` is the ARN hash the index holds for the row.
+        """
+        if kind == DUPLICATE_SUBSCRIPTION:
+            self.unsubscribes.append(arn)
+        elif kind == ORPHAN_SUBSCRIPTION:
+            self.orphans.append((phone, arn))
+        elif kind == INACTIVE_SUBSCRIPTION:
+            self.inactive.append((phone, arn, fingerprint))
+        elif kind == STALE_ARN:
+            self.stale.append((phone, arn, fingerprint))
+        elif kind == MISSING_SUBSCRIPTION:
+            self.missing.append((phone, fingerprint))
+
+        pending = (
+            len(self.unsubscribes) + len(self.orphans) + len(self.inactive)
+            + len(self.stale) + len(self.missing)
+        )
+        if pending >= REPAIR_CHUNK_SIZE:
+            self.flush()
+
+    def _unsubscribe(self, arn):
+        try:
+            sns.unsubscribe(SubscriptionArn=arn)
+            return True
+        except Exception as e:
+            logger.error(f"Error unsubscribing {arn}: {str(e)}")
+            return False
+
+    def _subscribe(self, phone):
+        try:
+            response = sns.subscribe(TopicArn=self.topic_arn, Protocol='sms', Endpoint=phone)
+            return phone, response['SubscriptionArn']
+        except Exception as e:
+            logger.error(f"Error subscribing {mask_phone(phone)}: {str(e)}")
+            return phone, None
+
+    def _recheck(self):
+        """
+        Re-read buffered rows before acting on them. The index is built before
+        the topic is listed, so rows added, removed or re-subscribed during the
+        scan disagree with it; only drift the current row still shows is repaired.
+        """
+        phones = list(dict.fromkeys(
+            [phone for phone, _ in self.orphans]
+            + [phone for phone, _, _ in self.inactive]
+            + [phone for phone, _, _ in self.stale]
+            + [phone for phone, _ in self.missing]
+        ))
+        items = batch_get(
+            dynamodb, self.table_name, [{'phone_number': phone} for phone in phones],
+            projection='phone_number, subscription_arn, active'
+        )
+        rows = {item['phone_number']: item for item in items}
+
+        def current(phone, fingerprint):
+            # The row as indexed, or None if it has changed since the scan
+            row = rows.get(phone)
+            if row is None or arn_hash(row.get('subscription_arn')) != fingerprint:
+                return None
+            return row
+
+        def keep(changed):
+            if changed:
+                self.rechecked += 1
+            return not changed
+
+        for phone, arn in self.orphans:
+            if keep(phone in rows):
+                if self.adopt_orphans:
+                    self.adoptions.append((phone, arn))
+                else:
+                    self.unsubscribes.append(arn)
+        for phone, arn, fingerprint in self.inactive:
+            row = current(phone, fingerprint)
+            if keep(row is None or row.get('active', True) is not False):
+                self.unsubscribes.append(arn)
+        for phone, arn, fingerprint in self.stale:
+            row = current(phone, fingerprint)
+            if keep(row is None or row.get('active', True) is False):
+                self.arn_updates.append((phone, arn))
+        for phone, fingerprint in self.missing:
+            row = current(phone, fingerprint)
+            if keep(row is None or row.get('active', True) is False):
+                self.subscribes.append(phone)
+
+        self.orphans = []
+        self.inactive = []
+        self.stale = []
+        self.missing = []
+
+    def flush(self):
+        if self.orphans or self.inactive or self.stale or self.missing:
+            self._recheck()
+        with ThreadPoolExecutor(max_workers=REPAIR_THREADS) as executor:
+            self.failures += sum(1 for ok in executor.map(self._unsubscribe, self.unsubscribes) if not ok)
+            for phone, arn in executor.map(self._subscribe, self.subscribes):
+                if arn:
+                    self.arn_updates.append((phone, arn))
+                else:
+                    self.failures += 1
+
+        statements = [
+            (
+                f'UPDATE "{self.table_name}" SET "subscription_arn" = ? WHERE "phone_number" = ?',
+                [{'S': arn}, {'S': phone}]
+            )
+            for phone, arn in self.arn_updates
+        ]
+        created_at = datetime.utcnow().isoformat()
+        statements.extend(
+            (
+                f'INSERT INTO "{self.table_name}" VALUE '
+                "{'phone_number': ?, 'subscription_arn': ?, 'active': ?, 'created_at': ?}",
+                [{'S': phone}, {'S': arn}, {'BOOL': True}, {'S': created_at}]
+            )
+            for phone, arn in self.adoptions
+        )
+        self.failures += len(batch_execute(dynamodb.meta.client, statements)) if statements else 0
+
+        self.unsubscribes = []
+        self.subscribes = []
+        self.arn_updates = []
+        self.adoptions = []
+
+def reconcile(topic_arn=SNS_TOPIC_ARN, repair=False, adopt_orphans=False, total_segments=RECONCILE_SCAN_SEGMENTS):
+    """
+    Compare every SNS subscription with every table row and report drift,
+    optionally repairing it. Returns a report of counts and masked samples.
+    """
+    index, invalid_rows = load_table_index(total_segments)
+    logger.info(f"Indexed {len(index.keys)} table rows")
+    repairer = Repairer(topic_arn, SUBSCRIBERS_TABLE, adopt_orphans) if repair else None
+    counts = {}
+    samples = {}
+
+    def record(kind, phone, arn=None, fingerprint=0):
+        counts[kind] = counts.get(kind, 0) + 1
+        kind_samples = samples.setdefault(kind, [])
+        if len(kind_samples) < SAMPLE_SIZE:
+            kind_samples.append(mask_phone(phone))
+        if repairer:
+            repairer.add(kind, phone, arn, fingerprint)
+
+    for phone in invalid_rows:
+        record(INVALID_PHONE, phone)
+
+    subscriptions = 0
+    for phone, arn in iter_topic_subscriptions(topic_arn):
+        subscriptions += 1
+        try:
+            key = phone_key(phone)
+        except ValueError:
+            record(INVALID_PHONE, phone)
+            continue
+
+        position = index.find(key)
+        if position is None:
+            record(ORPHAN_SUBSCRIPTION, phone, arn)
+        elif index.seen[position]:
+            record(DUPLICATE_SUBSCRIPTION, phone, arn)
+        else:
+            index.seen[position] = 1
+            if not index.active[position]:
+                record(INACTIVE_SUBSCRIPTION, phone, arn, index.arn_hashes[position])
+            elif index.arn_hashes[position] != arn_hash(arn):
+                record(STALE_ARN, phone, arn, index.arn_hashes[position])
+
+    for position, seen in enumerate(index.seen):
+        if not seen and index.active[position]:
+            record(MISSING_SUBSCRIPTION, phone_from_key(index.keys[position]), fingerprint=index.arn_hashes[position])
+
+    if repairer:
+        repairer.flush()
+        if repairer.rechecked:
+            logger.info(f"Left {repairer.rechecked} drifted subscriptions alone: their rows changed during the scan")
+
+    report = {
+        'table_rows': len(index.keys) + len(invalid_rows),
+        'subscriptions': subscriptions,
+        'drift': counts,
+        'samples': samples,
+        'repaired': repair,
+        'repair_failures': repairer.failures if repairer else 0
+    }
+    logger.info(json.dumps({'reconciliation': report}))
+    return report
+
+def lambda_handler(event, context):
+    """
+    Scheduled entry point; repairs when RECONCILE_REPAIR is set or the event asks for it
+    """
+    try:
+        repair = bool(event.get('repair', RECONCILE_REPAIR))
+        return {
+            'statusCode': 200,
+            'body': json.dumps(reconcile(repair=repair, adopt_orphans=bool(event.get('adopt_orphans'))))
+        }
+    except Exception as e:
+        logger.error(f"Error reconciling subscribers: {str(e)}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps(f'Error: {str(e)}')
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconcile SNS subscriptions with the subscribers table')
+    parser.add_argument('--topic-arn', default=SNS_TOPIC_ARN, help='SNS Topic ARN')
+    parser.add_argument('--repair', action='store_true', help='Fix drift instead of only reporting it')
+    parser.add_argument('--adopt-orphans', action='store_true',
+                        help='Add table rows for subscriptions with no row instead of unsubscribing them')
+    parser.add_argument('--segments', type=int, default=RECONCILE_SCAN_SEGMENTS, help='Parallel table scan segments')
+
+    args = parser.parse_args()
+
+    if not args.topic_arn or not SUBSCRIBERS_TABLE:
+        print("Error: --topic-arn (or SNS_TOPIC_ARN) and SUBSCRIBERS_TABLE are required")
+        sys.exit(1)
+
+    report = reconcile(args.topic_arn, args.repair, args.adopt_orphans, args.segments)
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if report['repair_failures'] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Aggregated per-run logging for Daily Uplift SMS"""
+import json
+import os
+import random
+import time
+import logging
+import threading
+
+# Configure logging
+logger = logging.getLogger()
+
+# Get environment variables
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '0.001'))
+LOG_DEBUG_MESSAGES = os.environ.get('LOG_DEBUG_MESSAGES', '').lower() in ('1', 'true', 'yes')
+
+def mask_phone(phone):
+    """
+    Mask a phone number for logs, keeping the country code prefix and last two digits
+    """
+    if not phone or len(phone) <= 6:
+        return '***'
+    return f"{phone[:3]}{'*' * (len(phone) - 5)}{phone[-2:]}"
+
+class RunSummary:
+    """
+    Aggregates counts for one run and logs a single structured summary.
+    Per-message lines are sampled with masked numbers and no error text;
+    LOG_DEBUG_MESSAGES logs every message with the full number and error.
+    """
+
+    def __init__(self, run, sample_rate=LOG_SAMPLE_RATE, debug=LOG_DEBUG_MESSAGES):
+        self.run = run
+        self.sample_rate = sample_rate
+        self.debug = debug
+        self.started_at = time.monotonic()
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.segments = 0
+        self.categories = {}
+        self.errors = {}
+        self.skip_reasons = {}
+
+    def _log_message(self, level, action, phone, detail):
+        if self.debug:
+            logger.log(level, f"{action} {phone} {detail}")
+        elif self.sample_rate > 0 and random.random() < self.sample_rate:
+            logger.log(level, f"{action} {mask_phone(phone)} {detail}")
+
+    def record_sent(self, phone, category, message_id, segments=1):
+        """
+        Record a successful send
+        """
+        with self.lock:
+            self.sent += 1
+            self.segments += segments
+            totals = self.categories.setdefault(category, {'sent': 0, 'failed': 0, 'segments': 0})
+            totals['sent'] += 1
+            totals['segments'] += segments
+        self._log_message(logging.INFO, 'Message sent to', phone, f"({category}): {message_id}")
+
+    def record_failed(self, phone, category, error):
+        """
+        Record a failed send, grouped by error type
+        """
+        # botocore ClientErrors are grouped by their AWS error code, e.g. Throttling
+        response = getattr(error, 'response', None)
+        error_type = (isinstance(response, dict) and response.get('Error', {}).get('Code')) or type(error).__name__
+        with self.lock:
+            self.failed += 1
+            self.errors[error_type] = self.errors.get(error_type, 0) + 1
+            totals = self.categories.setdefault(category, {'sent': 0, 'failed': 0, 'segments': 0})
+            totals['failed'] += 1
+        if self.debug:
+            self._log_message(logging.ERROR, 'Error sending to', phone, f"({category}): {error_type}: {error}")
+        else:
+            # SNS error messages can quote the full destination number
+            self._log_message(logging.ERROR, 'Error sending to', phone, f"({category}): {error_type}")
+
+    def record_skipped(self, phone, reason):
+        """
+        Record a subscriber that was deliberately not sent to
+        """
+        with self.lock:
+            self.skipped += 1
+            self.skip_reasons[reason] = self.skip_reasons.get(reason, 0) + 1
+        self._log_message(logging.INFO, 'Skipped', phone, f"({reason})")
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'run': self.run,
+                'sent': self.sent,
+                'failed': self.failed,
+                'skipped': self.skipped,
+                'segments': self.segments,
+                'categories': {category: dict(totals) for category, totals in self.categories.items()},
+                'errors': dict(self.errors),
+                'skip_reasons': dict(self.skip_reasons),
+                'duration_ms': int((time.monotonic() - self.started_at) * 1000)
+            }
+
+    def emit(self):
+        """
+        Log the run summary as one structured record
+        """
+        summary = self.as_dict()
+        level = logging.ERROR if summary['failed'] else logging.INFO
+        logger.log(level, json.dumps({'run_summary': summary}))
+        return summary
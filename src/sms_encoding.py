@@ -0,0 +1,72 @@
+"""SMS encoding and segment analysis for Daily Uplift SMS"""
+import unicodedata
+from collections import namedtuple
+from functools import lru_cache
+
+# GSM 03.38 basic character set (one septet each)
+GSM_BASIC = frozenset(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+
+# GSM 03.38 extension table (escape + character, two septets each)
+GSM_EXTENDED = frozenset("^{}\\[~]|€\f")
+
+# Characters per segment: (single message, each part of a concatenated message)
+GSM_SEGMENT_SIZE = (160, 153)
+UCS2_SEGMENT_SIZE = (70, 67)
+
+# Common typographic characters and their closest GSM-7 equivalents
+GSM_REPLACEMENTS = {
+    '‘': "'", '’': "'", '‚': "'", '‛': "'", '′': "'",
+    '“': '"', '”': '"', '„': '"', '‟': '"', '″': '"',
+    '–': '-', '—': '-', '―': '-', '−': '-', '‐': '-', '‑': '-',
+    '…': '...', '•': '-', '·': '-',
+    '\u00a0': ' ', '\u2002': ' ', '\u2003': ' ', '\u2009': ' ', '\u200a': ' ', '\u202f': ' ',
+    '\u200b': '', '\ufeff': '',
+    '\t': ' ', '`': "'", '´': "'"
+}
+
+SmsInfo = namedtuple('SmsInfo', ['encoding', 'units', 'segments', 'non_gsm'])
+
+def _segment_count(units, sizes):
+    single, part = sizes
+    if units <= single:
+        return 1
+    return -(-units // part)
+
+@lru_cache(maxsize=4096)
+def analyze(text):
+    """
+    Get the encoding, length in encoding units, and segment count of a message.
+    GSM-7 units are septets; UCS-2 units are UTF-16 code units.
+    """
+    non_gsm = tuple(sorted({c for c in text if c not in GSM_BASIC and c not in GSM_EXTENDED}))
+    if not non_gsm:
+        units = len(text) + sum(1 for c in text if c in GSM_EXTENDED)
+        return SmsInfo('GSM-7', units, _segment_count(units, GSM_SEGMENT_SIZE), non_gsm)
+
+    units = len(text.encode('utf-16-le')) // 2
+    return SmsInfo('UCS-2', units, _segment_count(units, UCS2_SEGMENT_SIZE), non_gsm)
+
+def normalize_to_gsm(text):
+    """
+    Replace characters outside GSM-7 with their closest GSM-7 equivalents.
+    Characters with no equivalent (e.g. emoji) are left as they are.
+    """
+    result = []
+    for c in text:
+        if c in GSM_BASIC or c in GSM_EXTENDED:
+            result.append(c)
+        elif c in GSM_REPLACEMENTS:
+            result.append(GSM_REPLACEMENTS[c])
+        else:
+            # Strip accents the GSM alphabet does not carry, e.g. á -> a
+            stripped = ''.join(
+                d for d in unicodedata.normalize('NFKD', c) if not unicodedata.combining(d)
+            )
+            if stripped and all(d in GSM_BASIC or d in GSM_EXTENDED for d in stripped):
+                result.append(stripped)
+            else:
+                result.append(c)
+    return ''.join(result)
@@ -21,12 +21,11 @@ document.addEventListener('DOMContentLoaded', function() {
 
 // Load dashboard data
 function loadDashboardData() {
-    // Load subscribers
-    fetchWithAuth(`${API_URL}/subscribers`)
-        .then(response => response.json())
-        .then(data => {
-            updateSubscribersList(data.subscribers);
-            document.getElementById('total-subscribers').textContent = data.count;
+    // Load subscribers, following page cursors until the last page
+    loadSubscribers()
+        .then(subscribers => {
+            updateSubscribersList(subscribers);
+            document.getElementById('total-subscribers').textContent = subscribers.length;
         })
         .catch(error => console.error('Error loading subscribers:', error));
     
@@ -39,6 +38,17 @@ function loadDashboardData() {
         .catch(error => console.error('Error loading analytics:', error));
 }
 
+// Fetch every page of subscribers
+function loadSubscribers(cursor, subscribers = []) {
+    const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+    return fetchWithAuth(`${API_URL}/subscribers${query}`)
+        .then(response => response.json())
+        .then(data => {
+            subscribers.push(...data.subscribers);
+            return data.next_cursor ? loadSubscribers(data.next_cursor, subscribers) : subscribers;
+        });
+}
+
 // Update subscribers list
 function updateSubscribersList(subscribers) {
     const tableBody = document.getElementById('subscribers-table');
@@ -295,6 +305,7 @@ function sendMessage(event) {
     const phone = document.getElementById('message-phone').value;
     const message = document.getElementById('message-text').value;
     const category = document.getElementById('message-category').value;
+    const normalize = document.getElementById('message-normalize').checked;
     
     fetchWithAuth(`${API_URL}/send`, {
         method: 'POST',
@@ -304,13 +315,14 @@ function sendMessage(event) {
         body: JSON.stringify({
             phone: phone,
             message: message,
-            category: category
+            category: category,
+            normalize: normalize
         })
     })
     .then(response => response.json())
     .then(data => {
         if (data.success) {
-            alert('Message sent successfully!');
+            alert(`Message sent successfully! (${data.segments} ${data.encoding} segment${data.segments === 1 ? '' : 's'})`);
             document.getElementById('message-text').value = '';
         } else {
             alert(`Error: ${data.message}`);
@@ -0,0 +1,96 @@
+"""Warm-container cache of subscriber preferences for Daily Uplift SMS"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+import boto3
+from dynamo_batch import batch_get
+
+# Configure logging
+logger = logging.getLogger()
+
+# Initialize clients
+dynamodb = boto3.resource('dynamodb')
+
+# Get environment variables
+SUBSCRIBERS_TABLE = os.environ.get('SUBSCRIBERS_TABLE')
+SUBSCRIBER_CACHE_SIZE = int(os.environ.get('SUBSCRIBER_CACHE_SIZE', '10000'))
+SUBSCRIBER_CACHE_TTL_SECONDS = int(os.environ.get('SUBSCRIBER_CACHE_TTL_SECONDS', '300'))
+
+# Attributes the on-demand send path needs
+CACHED_FIELDS = ['phone_number', 'preferred_category', 'active']
+_PROJECTION = ', '.join(f'#f{i}' for i in range(len(CACHED_FIELDS)))
+_NAMES = {f'#f{i}': field for i, field in enumerate(CACHED_FIELDS)}
+
+# Per-container LRU of phone -> (expires_at, item), survives across warm invocations.
+# Subscribers are changed by other functions (the API, scripts, the console),
+# so there is nothing to invalidate here: every change shows up once the TTL expires.
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+def _lookup(phone, now):
+    entry = _cache.get(phone)
+    if entry is None:
+        return None
+    if entry[0] <= now:
+        del _cache[phone]
+        return None
+    _cache.move_to_end(phone)
+    return entry[1]
+
+def _store(items, now):
+    expires_at = now + SUBSCRIBER_CACHE_TTL_SECONDS
+    with _lock:
+        for item in items:
+            _cache[item['phone_number']] = (expires_at, item)
+            _cache.move_to_end(item['phone_number'])
+        while len(_cache) > SUBSCRIBER_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+def get_subscriber(phone):
+    """
+    Get one subscriber's preferences, reading DynamoDB only on a cache miss.
+    Returns None for unknown numbers; misses are not cached, so a new
+    subscriber is found on the next request.
+    """
+    now = time.monotonic()
+    with _lock:
+        item = _lookup(phone, now)
+    if item is not None:
+        return item
+
+    item = dynamodb.Table(SUBSCRIBERS_TABLE).get_item(
+        Key={'phone_number': phone},
+        ProjectionExpression=_PROJECTION,
+        ExpressionAttributeNames=_NAMES
+    ).get('Item')
+    if item:
+        _store([item], now)
+    return item
+
+def get_subscribers(phones):
+    """
+    Get preferences for many subscribers as {phone: item}. Cache misses are
+    fetched with BatchGetItem, one round trip per 100 numbers.
+    """
+    now = time.monotonic()
+    found = {}
+    missing = []
+    with _lock:
+        for phone in dict.fromkeys(phones):
+            item = _lookup(phone, now)
+            if item is None:
+                missing.append(phone)
+            else:
+                found[phone] = item
+
+    if missing:
+        items = batch_get(
+            dynamodb, SUBSCRIBERS_TABLE, [{'phone_number': phone} for phone in missing],
+            projection=_PROJECTION, attribute_names=_NAMES
+        )
+        _store(items, now)
+        for item in items:
+            found[item['phone_number']] = item
+    return found
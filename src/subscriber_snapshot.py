@@ -0,0 +1,578 @@
+#!/usr/bin/env python3
+"""Compact binary snapshot of subscribers, kept fresh from the DynamoDB stream"""
+import gzip
+import json
+import mmap
+import os
+import sys
+import time
+import uuid
+import struct
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from boto3.dynamodb.types import TypeDeserializer
+from phone_numbers import phone_key, phone_from_key
+from message_rotation import ROTATION_ATTRIBUTE_PREFIX, rotation_attribute, rotation_category, get_cursor
+from run_summary import mask_phone
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Initialize clients
+s3 = boto3.client('s3')
+dynamodb = boto3.resource('dynamodb')
+
+# Get environment variables
+SUBSCRIBERS_TABLE = os.environ.get('SUBSCRIBERS_TABLE')
+SNAPSHOT_BUCKET = os.environ.get('SNAPSHOT_BUCKET')
+SNAPSHOT_KEY = os.environ.get('SNAPSHOT_KEY', 'snapshots/subscribers.snap')
+SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH', '/tmp/subscribers.snap')
+SNAPSHOT_MAX_AGE_SECONDS = int(os.environ.get('SNAPSHOT_MAX_AGE_SECONDS', '129600'))
+SNAPSHOT_REBUILD_SECONDS = int(os.environ.get('SNAPSHOT_REBUILD_SECONDS', '86400'))
+SNAPSHOT_CURSOR_QUIET_SECONDS = int(os.environ.get('SNAPSHOT_CURSOR_QUIET_SECONDS', '300'))
+
+# Rotation cursor advances waiting to be folded into the snapshot, one small object per stream batch
+CURSORS_PREFIX = f"{SNAPSHOT_KEY}.cursors/"
+
+# File layout: header, JSON list of category names, then fixed-size records
+# sorted by phone key. Records are big-endian so byte order matches key order.
+# built_at is when the last full table scan started; updated_at moves with every change.
+MAGIC = b'DUSS'
+VERSION = 3
+HEADER = struct.Struct('>4sHxxIddI')   # magic, version, record count, built_at, updated_at, categories length
+RECORD = struct.Struct('>QBBI')        # phone key, category index, active, rotation cursor
+MAX_CATEGORIES = 0xFF
+
+_deserializer = TypeDeserializer()
+
+class SubscriberSnapshot:
+    """
+    Read-only, memory-mapped view of a snapshot file
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, self.built_at, self.updated_at, categories_length = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a subscriber snapshot: {path}")
+        self.categories = json.loads(bytes(self.buffer[HEADER.size:HEADER.size + categories_length]))
+        self.records_offset = HEADER.size + categories_length
+
+    def age(self):
+        """
+        Seconds since the snapshot was built from a full scan. Stream updates
+        do not reset this, so changes the stream missed cannot persist forever.
+        """
+        return time.time() - self.built_at
+
+    def records(self):
+        """
+        Iterate over raw (phone key, category index, active, cursor) records
+        """
+        view = memoryview(self.buffer)[self.records_offset:self.records_offset + self.count * RECORD.size]
+        return RECORD.iter_unpack(view)
+
+    def subscribers(self, active_only=True):
+        """
+        Iterate over subscribers in the same shape as table items
+        """
+        categories = self.categories
+        for key, category_index, active, cursor in self.records():
+            if active_only and not active:
+                continue
+            subscriber = {'phone_number': phone_from_key(key), 'active': bool(active)}
+            category = categories[category_index]
+            subscriber['preferred_category'] = category
+            subscriber[rotation_attribute(category)] = cursor
+            yield subscriber
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+def encode_item(item, categories):
+    """
+    Encode a subscriber item as a (key, record bytes) pair, adding its
+    category to `categories` if new
+    """
+    key = phone_key(item['phone_number'])
+    # Keep the cursor of the category the sender advances, so rows without
+    # a preferred category still rotate
+    category = rotation_category(item)
+    if category not in categories:
+        if len(categories) >= MAX_CATEGORIES:
+            raise ValueError('Too many categories for a snapshot')
+        categories.append(category)
+    category_index = categories.index(category)
+    cursor = get_cursor(item, category)
+    # Rows written without an active flag (e.g. by add_subscriber.py) count as active
+    active = item.get('active', True) is not False
+    return key, RECORD.pack(key, category_index, active, cursor)
+
+def write_snapshot(path, records, categories, built_at):
+    """
+    Atomically write sorted record bytes and the category table to `path`
+    """
+    count = sum(len(record) for record in records) // RECORD.size
+    categories_bytes = json.dumps(categories).encode('utf-8')
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, count, built_at, time.time(), len(categories_bytes)))
+        f.write(categories_bytes)
+        f.writelines(records)
+    os.replace(tmp_path, path)
+
+class SnapshotBuilder:
+    """
+    Collects subscriber items (e.g. during a full scan) and writes a snapshot.
+    Rows with numbers that are not E.164 are skipped and counted; running out
+    of category indexes invalidates the whole build.
+    """
+
+    def __init__(self):
+        # Taken before the scan starts, so changes made during it count as newer
+        self.built_at = time.time()
+        self.categories = []
+        self.records = []
+        self.skipped = 0
+        self.valid = True
+
+    def add(self, item):
+        if not self.valid:
+            return
+        phone = item.get('phone_number') or ''
+        try:
+            phone_key(phone)
+        except ValueError:
+            logger.warning(f"Leaving {mask_phone(phone)} out of the subscriber snapshot: not an E.164 number")
+            self.skipped += 1
+            return
+        try:
+            self.records.append(encode_item(item, self.categories)[1])
+        except ValueError as e:
+            logger.warning(f"Not building subscriber snapshot: {str(e)}")
+            self.valid = False
+            self.records = []
+
+    def save(self, path=SNAPSHOT_PATH):
+        if not self.valid:
+            return False
+        # Big-endian records sort by phone key as plain bytes
+        self.records.sort()
+        write_snapshot(path, self.records, self.categories, self.built_at)
+        return True
+
+def _find(data, count, key):
+    """
+    Binary search record bytes for a phone key. Returns (index, found).
+    """
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        if RECORD.unpack_from(data, middle * RECORD.size)[0] < key:
+            low = middle + 1
+        else:
+            high = middle
+    return low, low < count and RECORD.unpack_from(data, low * RECORD.size)[0] == key
+
+def _read_records(path):
+    """
+    Read a snapshot's categories, built_at, and a mutable copy of its records
+    """
+    snapshot = SubscriberSnapshot(path)
+    try:
+        data = bytearray(snapshot.buffer[snapshot.records_offset:snapshot.records_offset + snapshot.count * RECORD.size])
+        return list(snapshot.categories), snapshot.built_at, data
+    finally:
+        snapshot.close()
+
+def apply_changes(path, changes):
+    """
+    Apply {phone: item or None} changes to the snapshot at `path`.
+    Existing records are patched in place; inserts and removals are merged
+    in one sorted pass. The build time is kept, so a snapshot only ever
+    updated from the stream still goes stale. Changes that cannot be encoded
+    are logged and skipped so one bad row never blocks the stream.
+    """
+    if os.path.exists(path):
+        categories, built_at, data = _read_records(path)
+    else:
+        # Never built from a scan, so stale from the start
+        categories, built_at, data = [], 0, bytearray()
+
+    count = len(data) // RECORD.size
+    inserts = {}
+    removals = set()
+    for phone, item in changes.items():
+        try:
+            key = phone_key(phone)
+        except ValueError:
+            logger.warning(f"Skipping snapshot change for {mask_phone(phone)}: not an E.164 number")
+            continue
+        low, found = _find(data, count, key)
+
+        try:
+            if item is None:
+                if found:
+                    removals.add(key)
+            elif found:
+                data[low * RECORD.size:(low + 1) * RECORD.size] = encode_item(item, categories)[1]
+            else:
+                inserts[key] = encode_item(item, categories)[1]
+        except ValueError as e:
+            logger.warning(f"Skipping snapshot change for {mask_phone(phone)}: {str(e)}")
+
+    if inserts or removals:
+        merged = []
+        new_records = sorted(inserts.items())
+        position = 0
+        for offset in range(0, len(data), RECORD.size):
+            record = bytes(data[offset:offset + RECORD.size])
+            key = RECORD.unpack_from(record)[0]
+            while position < len(new_records) and new_records[position][0] < key:
+                merged.append(new_records[position][1])
+                position += 1
+            if key not in removals:
+                merged.append(record)
+        merged.extend(record for _, record in new_records[position:])
+        write_snapshot(path, merged, categories, built_at)
+    else:
+        write_snapshot(path, [bytes(data)], categories, built_at)
+
+def apply_cursor_advances(path, advances):
+    """
+    Patch rotation cursors from (phone, category, cursor) advances in place,
+    in one pass over the snapshot at `path`. Only subscribers still in the
+    snapshot with that rotation category are touched, and cursors never
+    move backwards, so replaying an advance is harmless. Returns the number
+    of records changed.
+    """
+    categories, built_at, data = _read_records(path)
+    count = len(data) // RECORD.size
+    indexes = {category: index for index, category in enumerate(categories)}
+    applied = 0
+    for phone, category, cursor in advances:
+        if category not in indexes:
+            continue
+        try:
+            index, found = _find(data, count, phone_key(phone))
+        except ValueError:
+            continue
+        if not found:
+            continue
+        key, category_index, active, current = RECORD.unpack_from(data, index * RECORD.size)
+        if category_index == indexes[category] and cursor > current:
+            RECORD.pack_into(data, index * RECORD.size, key, category_index, active, cursor)
+            applied += 1
+    write_snapshot(path, [bytes(data)], categories, built_at)
+    return applied
+
+def _record_phone(record):
+    keys = record.get('dynamodb', {}).get('Keys', {})
+    return _deserializer.deserialize(keys['phone_number']) if 'phone_number' in keys else None
+
+def _cursor_only(record):
+    """
+    Whether a stream record only moved rotation cursors (needs NEW_AND_OLD_IMAGES)
+    """
+    data = record.get('dynamodb', {})
+    if record.get('eventName') != 'MODIFY' or 'OldImage' not in data or 'NewImage' not in data:
+        return False
+    old, new = data['OldImage'], data['NewImage']
+    return all(
+        name.startswith(ROTATION_ATTRIBUTE_PREFIX)
+        for name in set(old) | set(new)
+        if old.get(name) != new.get(name)
+    )
+
+def changes_from_stream_records(records):
+    """
+    Reduce DynamoDB stream records to {phone: item or None}, keeping the latest change per phone
+    """
+    changes = {}
+    for record in records:
+        phone = _record_phone(record)
+        if not phone:
+            continue
+        data = record.get('dynamodb', {})
+        if record.get('eventName') == 'REMOVE':
+            changes[phone] = None
+        elif 'NewImage' in data:
+            changes[phone] = {k: _deserializer.deserialize(v) for k, v in data['NewImage'].items()}
+    return changes
+
+def split_stream_records(records):
+    """
+    Reduce stream records to ({phone: item or None}, [(phone, category, cursor)]).
+    Phones whose only changes in the batch were rotation cursor advances are
+    returned as advances; any other change sends the phone's latest image
+    through the first result.
+    """
+    records = list(records)
+    changes = changes_from_stream_records(records)
+    membership = {_record_phone(record) for record in records if not _cursor_only(record)}
+    advances = []
+    for phone, item in changes.items():
+        if phone in membership:
+            continue
+        # The snapshot only keeps the cursor of the category the sender uses
+        category = rotation_category(item)
+        advances.append((phone, category, get_cursor(item, category)))
+    return {phone: item for phone, item in changes.items() if phone in membership}, advances
+
+def scan_subscribers():
+    """
+    Stream every subscriber row. Raises on failure so a cut-short scan is
+    never mistaken for the full table.
+    """
+    table = dynamodb.Table(SUBSCRIBERS_TABLE)
+    scan_kwargs = {}
+    while True:
+        response = table.scan(**scan_kwargs)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def download_snapshot(path=SNAPSHOT_PATH):
+    """
+    Fetch the snapshot from S3 unless the local copy is already current.
+    Returns False if no snapshot exists yet.
+    """
+    etag_path = f"{path}.etag"
+    try:
+        head = s3.head_object(Bucket=SNAPSHOT_BUCKET, Key=SNAPSHOT_KEY)
+    except s3.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+
+    if os.path.exists(path) and os.path.exists(etag_path):
+        with open(etag_path, 'r') as f:
+            if f.read() == head['ETag']:
+                return True
+
+    s3.download_file(SNAPSHOT_BUCKET, SNAPSHOT_KEY, path)
+    with open(etag_path, 'w') as f:
+        f.write(head['ETag'])
+    return True
+
+def snapshot_age(path=SNAPSHOT_PATH):
+    """
+    Seconds since the local snapshot was built, or None if it is missing or unreadable
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        snapshot = SubscriberSnapshot(path)
+    except ValueError as e:
+        logger.warning(f"Ignoring subscriber snapshot: {str(e)}")
+        return None
+    try:
+        return snapshot.age()
+    finally:
+        snapshot.close()
+
+def upload_snapshot(path=SNAPSHOT_PATH):
+    """
+    Publish the local snapshot to S3
+    """
+    s3.upload_file(path, SNAPSHOT_BUCKET, SNAPSHOT_KEY)
+    etag_path = f"{path}.etag"
+    if os.path.exists(etag_path):
+        os.remove(etag_path)
+
+def open_fresh_snapshot(max_age=SNAPSHOT_MAX_AGE_SECONDS):
+    """
+    Open the snapshot if it exists and is fresh, otherwise return None
+    """
+    try:
+        if SNAPSHOT_BUCKET and not download_snapshot():
+            return None
+        if not os.path.exists(SNAPSHOT_PATH):
+            return None
+        snapshot = SubscriberSnapshot(SNAPSHOT_PATH)
+    except Exception as e:
+        logger.error(f"Error opening subscriber snapshot: {str(e)}")
+        return None
+
+    if snapshot.age() > max_age:
+        logger.info(f"Subscriber snapshot is stale ({int(snapshot.age())}s old)")
+        snapshot.close()
+        return None
+    return snapshot
+
+def iter_active_subscribers(scan):
+    """
+    Stream active subscribers from a fresh snapshot, or from `scan()` when the
+    snapshot is missing or stale. Readers never write the snapshot; the
+    stream function rebuilds it on its schedule.
+    """
+    snapshot = open_fresh_snapshot()
+    if snapshot:
+        logger.info(f"Reading {snapshot.count} subscribers from snapshot")
+        try:
+            yield from snapshot.subscribers()
+        finally:
+            snapshot.close()
+        return
+
+    for item in scan():
+        if item.get('active', True) is not False:
+            yield item
+
+def rebuild_snapshot(scan=scan_subscribers):
+    """
+    Build the snapshot from a full scan and publish it. Stream changes made
+    during the scan are applied afterwards, since the stream function is the
+    only writer and processes them after this returns.
+    """
+    builder = SnapshotBuilder()
+    for item in scan():
+        builder.add(item)
+    if not builder.save():
+        return False
+    if SNAPSHOT_BUCKET:
+        upload_snapshot()
+    logger.info(f"Rebuilt subscriber snapshot with {len(builder.records)} subscribers, skipped {builder.skipped}")
+    return True
+
+def save_pending_advances(advances):
+    """
+    Park a stream batch's cursor advances in S3 until the next consolidation
+    """
+    key = f"{CURSORS_PREFIX}{int(time.time() * 1000):013d}-{uuid.uuid4().hex}.json.gz"
+    data = gzip.compress(json.dumps(advances, separators=(',', ':')).encode('utf-8'))
+    s3.put_object(Bucket=SNAPSHOT_BUCKET, Key=key, Body=data)
+
+def list_pending_advances():
+    """
+    Keys of parked cursor advances, oldest first
+    """
+    keys = []
+    list_kwargs = {'Bucket': SNAPSHOT_BUCKET, 'Prefix': CURSORS_PREFIX}
+    while True:
+        response = s3.list_objects_v2(**list_kwargs)
+        keys.extend(item['Key'] for item in response.get('Contents', []))
+        if not response.get('IsTruncated'):
+            break
+        list_kwargs['ContinuationToken'] = response['NextContinuationToken']
+    return sorted(keys)
+
+def _pending_written_at(key):
+    return int(key[len(CURSORS_PREFIX):].split('-', 1)[0]) / 1000
+
+def _read_pending(key):
+    return json.loads(gzip.decompress(s3.get_object(Bucket=SNAPSHOT_BUCKET, Key=key)['Body'].read()))
+
+def load_pending_advances(keys):
+    """
+    Read parked cursor advances in the order they were written
+    """
+    advances = []
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for batch in executor.map(_read_pending, keys):
+            advances.extend(batch)
+    return advances
+
+def delete_pending_advances(keys):
+    for start in range(0, len(keys), 1000):
+        s3.delete_objects(
+            Bucket=SNAPSHOT_BUCKET,
+            Delete={'Objects': [{'Key': key} for key in keys[start:start + 1000]], 'Quiet': True}
+        )
+
+def stream_handler(event, context):
+    """
+    DynamoDB Streams and scheduled entry point, and the only writer of the snapshot.
+    Membership and preference changes are applied per batch. Rotation cursor
+    advances, which a send run produces for every subscriber, are parked and
+    folded in with one pass once the run goes quiet. Scheduled invocations
+    (no Records) rebuild the snapshot from a full scan when it is missing or
+    due, then fold in everything parked.
+    """
+    records = event.get('Records')
+    changes, advances = split_stream_records(records or [])
+
+    if not SNAPSHOT_BUCKET:
+        # Local mode: a single file and no concurrent readers to protect
+        if not records:
+            rebuild_snapshot()
+            return {'rebuilt': True}
+        apply_changes(SNAPSHOT_PATH, changes)
+        applied = apply_cursor_advances(SNAPSHOT_PATH, advances) if advances else 0
+        return {'applied': len(changes), 'cursors': applied}
+
+    exists = download_snapshot()
+    age = snapshot_age() if exists else None
+    if not records:
+        if age is None or age > SNAPSHOT_REBUILD_SECONDS:
+            rebuild_snapshot()
+            age = 0
+    elif age is None:
+        # Nothing to update until the scheduled rebuild creates the snapshot
+        logger.info('No subscriber snapshot yet, skipping stream changes')
+        return {'applied': 0}
+
+    if advances:
+        save_pending_advances(advances)
+
+    dirty = False
+    if changes:
+        apply_changes(SNAPSHOT_PATH, changes)
+        dirty = True
+
+    pending = list_pending_advances()
+    consolidate = pending and (
+        not records or time.time() - _pending_written_at(pending[-1]) >= SNAPSHOT_CURSOR_QUIET_SECONDS
+    )
+    applied = 0
+    if consolidate:
+        applied = apply_cursor_advances(SNAPSHOT_PATH, load_pending_advances(pending))
+        dirty = True
+
+    if dirty:
+        upload_snapshot()
+    if consolidate:
+        # Only after the upload, so a failure replays the advances instead of losing them
+        delete_pending_advances(pending)
+    logger.info(f"Applied {len(changes)} subscriber changes and {applied} cursor advances to snapshot")
+    return {'applied': len(changes), 'cursors': applied}
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or update a local subscriber snapshot')
+    parser.add_argument('--snapshot', default=SNAPSHOT_PATH, help='Snapshot file path')
+    parser.add_argument('--build', help='JSON lines file of subscriber items to build the snapshot from')
+    parser.add_argument('--replay', help='JSON lines file of DynamoDB stream records to apply')
+    parser.add_argument('--dump', action='store_true', help='Print the snapshot contents')
+
+    args = parser.parse_args()
+
+    if args.build:
+        builder = SnapshotBuilder()
+        with open(args.build, 'r') as f:
+            for line in f:
+                if line.strip():
+                    builder.add(json.loads(line))
+        if not builder.save(args.snapshot):
+            sys.exit(1)
+        print(f"Built snapshot with {len(builder.records)} subscribers")
+
+    if args.replay:
+        with open(args.replay, 'r') as f:
+            changes = changes_from_stream_records(json.loads(line) for line in f if line.strip())
+        apply_changes(args.snapshot, changes)
+        print(f"Applied {len(changes)} changes")
+
+    if args.dump:
+        snapshot = SubscriberSnapshot(args.snapshot)
+        for subscriber in snapshot.subscribers(active_only=False):
+            print(json.dumps(subscriber))
+        snapshot.close()
+
+if __name__ == "__main__":
+    main()